@@ -0,0 +1,91 @@
+from concurrent.futures import ThreadPoolExecutor
+from courses import get_course_progress, dept_url, get_depts, parse_dept_page
+from fetch import HEADERS, RetryableStatus, backoff, check_status, get_timeout, request_stats
+from sections import CHUNK_SIZE, get_sections_progress, chunk_url, parse_chunk_page, split_into_chunks
+import asyncio
+import httpx
+import time
+
+# Alternative to the thread pools in `scrape_courses` and `scrape_sections`:
+# all pages are fetched concurrently on one event loop, limited only by
+# `concurrency`, and parsing is handed off to a pool of workers. Results are in
+# the same order as the threaded path.
+
+async def send_request(client: httpx.AsyncClient, uri: str, attempts=4, base_delay=1.0) -> str:
+    '''
+    Async counterpart of `fetch.send_request` with the same retry policy.
+    '''
+    for attempt in range(attempts):
+        start = time.perf_counter()
+        try:
+            response = await client.post(uri)
+            request_stats.record_request(time.perf_counter() - start, len(response.content))
+            check_status(response.status_code, request_stats)
+            return response.text
+        except (httpx.TransportError, RetryableStatus):
+            if attempt == attempts - 1:
+                request_stats.record_failure()
+                raise
+            request_stats.record_retry()
+            await asyncio.sleep(backoff(attempt, base_delay))
+
+def make_client(concurrency: int) -> httpx.AsyncClient:
+    (connect, read) = get_timeout()
+    return httpx.AsyncClient(
+        headers=HEADERS,
+        timeout=httpx.Timeout(read, connect=connect),
+        limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+    )
+
+async def _fetch_and_parse(client, semaphore, executor, url, mark_sending, parse_fn, *parse_args):
+    async with semaphore:
+        mark_sending()
+        page = await send_request(client, url)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, parse_fn, *parse_args, page)
+
+async def _scrape_courses(term: str, depts: list[str], concurrency: int, executor):
+    semaphore = asyncio.Semaphore(concurrency)
+    async with make_client(concurrency) as client:
+        async def for_dept(dept):
+            mark_sending = lambda: get_course_progress().mark_dept_sending_req(dept)
+            return await _fetch_and_parse(client, semaphore, executor, dept_url(dept, term),
+                                          mark_sending, parse_dept_page, dept)
+        return await asyncio.gather(*map(for_dept, depts))
+
+async def _scrape_sections(term: str, chunks: list[list[str]], concurrency: int, executor):
+    semaphore = asyncio.Semaphore(concurrency)
+    async with make_client(concurrency) as client:
+        async def for_chunk(chunk):
+            if len(chunk) == 0:
+                return []
+            mark_sending = lambda: get_sections_progress().mark_chunk_sending_req(chunk[0], chunk[-1])
+            return await _fetch_and_parse(client, semaphore, executor, chunk_url(chunk, term),
+                                          mark_sending, parse_chunk_page, chunk)
+        return await asyncio.gather(*map(for_chunk, chunks))
+
+def scrape_courses_async(term: str, dept: str, concurrency=8, parse_workers=4, select_depts=None):
+    depts = [dept] if dept else get_depts()
+    if select_depts is not None:
+        depts = select_depts(depts)
+    get_course_progress().reset()
+    get_course_progress().total_depts = len(depts)
+    get_course_progress().start_logging(num_workers=concurrency, request_stats=request_stats)
+    try:
+        with ThreadPoolExecutor(max_workers=parse_workers) as executor:
+            courses_lists = asyncio.run(_scrape_courses(term, depts, concurrency, executor))
+    finally:
+        get_course_progress().stop_logging()
+    return [course for sublist in courses_lists for course in sublist]
+
+def scrape_sections_async(term: str, course_codes, concurrency=8, parse_workers=4, chunk_size=CHUNK_SIZE):
+    chunks = split_into_chunks(course_codes, chunk_size, term)
+    get_sections_progress().reset()
+    get_sections_progress().courses_sections_to_parse = len(course_codes)
+    get_sections_progress().start_logging(num_workers=concurrency, request_stats=request_stats)
+    try:
+        with ThreadPoolExecutor(max_workers=parse_workers) as executor:
+            sections_lists = asyncio.run(_scrape_sections(term, chunks, concurrency, executor))
+    finally:
+        get_sections_progress().stop_logging()
+    return [section for sublist in sections_lists for section in sublist]
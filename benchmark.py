@@ -0,0 +1,177 @@
+import argparse
+import json
+import time
+import tracemalloc
+from courses import dept_url, get_depts, parse_dept_page
+from sections import CHUNK_SIZE, chunk_url, parse_chunk_page, split_into_chunks
+from instructors import get_instructors
+from parsing import PARSERS, set_parser
+from records import as_row, as_rows
+import fetch
+
+# Benchmarks the hot paths of the scraper against fixtures recorded with
+# `main.py --record <dir>`, without touching Testudo, PlanetTerp or the DB:
+#
+#   python3 main.py --term 202601 --courses --sections --instructors --print-output --record fixtures/202601
+#   python3 benchmark.py --term 202601 --fixtures fixtures/202601
+#
+# Stages run one after another on a single thread so that fetch and parse
+# times are measured separately; each stage is timed untraced, then run again
+# under tracemalloc for its peak memory. With `--baseline`, exits with an
+# error if any stage is more than `--tolerance` slower than in a previous
+# `--save`d run.
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the scraper against recorded fixtures")
+    parser.add_argument("--term", required=True, help="Term the fixtures were recorded for")
+    parser.add_argument("--fixtures", required=True, help="Directory of fixtures recorded with `main.py --record`")
+    parser.add_argument("--department", help="Only benchmark a specific department (e.g., CMSC)")
+    parser.add_argument("--instructors", action="store_true", help="Also benchmark fetching instructors")
+    parser.add_argument("--upload", action="store_true", help="Also upload to the DB; otherwise only the upload payloads are serialized")
+    parser.add_argument("--parser", choices=PARSERS, default="html.parser", help="HTML parser backend")
+    parser.add_argument("--save", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="Compare against results previously written with `--save`")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown relative to the baseline (0.2 = 20%%)")
+    return parser.parse_args()
+
+def run_stage(name: str, results: dict, fn, traced=True):
+    '''
+    Runs `fn` and records its wall time and number of items (the length of
+    its result), then, if `traced`, runs it again under tracemalloc to record
+    its peak memory. The timed run is untraced, since tracing slows it down.
+    Returns the result of the timed run.
+    '''
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+
+    peak_mb = None
+    if traced:
+        tracemalloc.start()
+        try:
+            fn()
+            (_, peak) = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        peak_mb = peak / 1_000_000
+
+    results[name] = {
+        "seconds": elapsed,
+        "items": len(result),
+        "items_per_second": len(result) / elapsed if elapsed > 0 else 0.0,
+        "peak_mb": peak_mb,
+    }
+    return result
+
+def retained_mb(build):
+    '''
+    Megabytes allocated by `build()` and still alive while its result is held.
+    Traced separately from the timed stages, since tracing slows them down.
+    '''
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        after = tracemalloc.get_traced_memory()[0]
+        del result
+    finally:
+        tracemalloc.stop()
+    return (after - before) / 1_000_000
+
+def run(args):
+    results = dict()
+
+    depts = run_stage("depts", results, lambda: [args.department] if args.department else get_depts())
+    dept_pages = run_stage("courses_fetch", results,
+                           lambda: [fetch.send_request(dept_url(dept, args.term)) for dept in depts])
+    courses = run_stage("courses_parse", results,
+                        lambda: [course for (dept, page) in zip(depts, dept_pages)
+                                 for course in parse_dept_page(dept, page, track_progress=False)])
+
+    course_codes = [course.course_code for course in courses]
+    chunks = split_into_chunks(course_codes, CHUNK_SIZE, args.term)
+    chunk_pages = run_stage("sections_fetch", results,
+                            lambda: [fetch.send_request(chunk_url(chunk, args.term)) for chunk in chunks])
+    sections = run_stage("sections_parse", results,
+                         lambda: [section for (chunk, page) in zip(chunks, chunk_pages)
+                                  for section in parse_chunk_page(chunk, page, track_progress=False)])
+
+    # Memory held by the parsed rows as records vs. as the dicts they're
+    # uploaded as. Each is parsed from the pages again, so neither shares
+    # strings or lists with the other or with `courses` and `sections`.
+    def parse_courses(convert):
+        return [convert(course) for (dept, page) in zip(depts, dept_pages)
+                for course in parse_dept_page(dept, page, track_progress=False)]
+
+    def parse_sections(convert):
+        return [convert(section) for (chunk, page) in zip(chunks, chunk_pages)
+                for section in parse_chunk_page(chunk, page, track_progress=False)]
+
+    keep = lambda record: record
+    results["records_mb"] = {
+        "courses": retained_mb(lambda: parse_courses(keep)),
+        "sections": retained_mb(lambda: parse_sections(keep)),
+    }
+    results["dicts_mb"] = {
+        "courses": retained_mb(lambda: parse_courses(as_row)),
+        "sections": retained_mb(lambda: parse_sections(as_row)),
+    }
+    del dept_pages, chunk_pages
+
+    if args.instructors:
+        run_stage("instructors", results, lambda: get_instructors(args.term))
+
+    def upload():
+        if args.upload:
+            from db import upload_data
+            upload_data(courses, False, table='courses')
+            upload_data(sections, False, table='sections')
+        else:
+            json.dumps(as_rows(courses))
+            json.dumps(as_rows(sections))
+        return courses + sections
+    # Uploading twice would only measure the DB's second response
+    run_stage("upload", results, upload, traced=not args.upload)
+
+    return results
+
+def print_results(results: dict):
+    print(f"{'stage':<16}{'seconds':>10}{'items':>10}{'items/s':>12}{'peak MB':>10}")
+    for (name, r) in results.items():
+        if "seconds" in r:
+            peak = "-" if r["peak_mb"] is None else f"{r['peak_mb']:.1f}"
+            print(f"{name:<16}{r['seconds']:>10.3f}{r['items']:>10}{r['items_per_second']:>12.1f}{peak:>10}")
+    for table in ("courses", "sections"):
+        print(f"{table} held as records: {results['records_mb'][table]:.1f} MB, "
+              f"as dicts: {results['dicts_mb'][table]:.1f} MB")
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    '''
+    Returns the names of stages more than `tolerance` slower than `baseline`.
+    '''
+    regressions = []
+    for (name, r) in results.items():
+        if "seconds" in r and name in baseline and r["seconds"] > baseline[name]["seconds"] * (1 + tolerance):
+            print(f"Stage {name} regressed: {r['seconds']:.3f}s vs. {baseline[name]['seconds']:.3f}s in baseline")
+            regressions.append(name)
+    return regressions
+
+def main():
+    args = parse_args()
+    set_parser(args.parser)
+    fetch.set_fixtures(replay_dir=args.fixtures)
+
+    results = run(args)
+    print_results(results)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import threading
+
+class ResponseCache:
+    '''
+    On-disk cache of Testudo pages, keyed by URL. Rather than the page itself,
+    each entry stores its validators (ETag/Last-Modified), a hash of its
+    content and the results of parsing it, so that an unchanged page doesn't
+    need to be parsed again. Least recently used entries are evicted once the
+    cache grows beyond `max_bytes`.
+    '''
+    def __init__(self, directory: str, max_bytes=200_000_000):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, url: str):
+        return os.path.join(self.directory, hashlib.sha1(url.encode()).hexdigest() + ".json")
+
+    def get(self, url: str):
+        try:
+            with open(self._path(url)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry if entry.get("url") == url else None
+
+    def validators(self, entry) -> dict:
+        '''
+        Conditional request headers for revalidating `entry`.
+        '''
+        headers = dict()
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def reuse(self, entry, page):
+        '''
+        Returns the parsed results stored in `entry` if `page` is unchanged
+        (or None, meaning the server answered 304), otherwise None.
+        '''
+        if entry is None:
+            return None
+        if page is not None and content_hash(page) != entry["content_hash"]:
+            return None
+        # Mark as recently used for eviction
+        try:
+            os.utime(self._path(entry["url"]))
+        except OSError:
+            pass
+        return entry["parsed"]
+
+    def store(self, url: str, page: str, headers, parsed):
+        entry = {
+            "url": url,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "content_hash": content_hash(page),
+            "parsed": parsed,
+        }
+        path = self._path(url)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entry, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def _evict(self):
+        with self.lock:
+            entries = []
+            for name in os.listdir(self.directory):
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+            total = sum(size for (_, size, _) in entries)
+            for (_, size, name) in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+                total -= size
+
+def content_hash(page: str) -> str:
+    return hashlib.sha256(page.encode()).hexdigest()
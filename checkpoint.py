@@ -0,0 +1,55 @@
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+
+class Checkpoint:
+    '''
+    On-disk record of the parsed results of each unit of a run (a department
+    page or a sections chunk), keyed by URL and written as soon as the unit
+    completes, so that a run that failed part way can be resumed without
+    fetching the completed units again. Cleared once a run succeeds.
+    '''
+    def __init__(self, directory: str, max_age=None):
+        '''
+        `max_age`: seconds for which stored units are reused, or None to only
+        record units without reusing them (i.e. without `--resume`)
+        '''
+        self.directory = directory
+        self.max_age = max_age
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, url: str):
+        return os.path.join(self.directory, hashlib.sha1(url.encode()).hexdigest() + ".json")
+
+    def get(self, url: str):
+        '''
+        The rows stored for `url` if they may be reused, otherwise None.
+        '''
+        if self.max_age is None:
+            return None
+        try:
+            with open(self._path(url)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("url") != url or time.time() - entry["time"] > self.max_age:
+            return None
+        return entry["rows"]
+
+    def store(self, url: str, rows):
+        entry = {"url": url, "time": time.time(), "rows": rows}
+        path = self._path(url)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entry, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    def clear(self):
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
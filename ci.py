@@ -1,8 +1,41 @@
-from db import get_supabase_client
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait
+from db import get_supabase_client, download_course_codes, execute_with_retry, row_hash
+import fetch
 import os
+import random
+from records import as_rows
 import requests
+from sections import get_sections_for_chunk, split_into_chunks
+import time
 
-def send_alert(table_name: str):
+# Minimum number of rows expected in each table, and the column counted. The
+# amounts are arbitrarily chosen based on what is considered to be a
+# reasonable amount and may require manual adjustment.
+MIN_ROWS = {
+    "courses": ("course_code", 2000),
+    "sections": ("course_code", 6000),
+    "instructors": ("slug", 13000),
+    "active_instructors": ("slug", 2000),
+}
+
+# Columns of a section compared against Testudo
+SECTION_COLUMNS = ["course_code", "sec_code", "instructors", "meetings", "open_seats", "total_seats",
+                   "waitlist", "holdfile"]
+
+# Sampled courses per Testudo request; small so that chunks finish well within
+# the time budget
+SAMPLE_CHUNK_SIZE = 10
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Verify that the DB is populated and up to date with Testudo")
+    parser.add_argument("--term", help="Term the DB holds; required to compare sampled courses with Testudo")
+    parser.add_argument("--sample", type=int, default=0, help="Number of random courses whose sections are re-scraped from Testudo and compared with the DB")
+    parser.add_argument("--max-stale", type=float, default=0.25, help="Highest fraction of sampled sections that may be missing, extra or different in the DB")
+    parser.add_argument("--time-budget", type=float, default=120, help="Seconds after which sampled courses that haven't been compared yet are skipped")
+    return parser.parse_args()
+
+def send_alert(table_name: str, problem="is not populated with enough data"):
     """
     Sends an alert by opening a GitHub issue and tagging Andrew (@atcupps).
     This should be modified with a rotation if more people join.
@@ -12,8 +45,8 @@ def send_alert(table_name: str):
         print("GITHUB_TOKEN is not set.")
         exit(1)
     repo = "jupiterp-umd/scraper"
-    title = f"Table {table_name} is not populated with enough data"
-    body = f"@atcupps Please investigate why the {table_name} table is not populated with enough data."
+    title = f"Table {table_name} {problem}"
+    body = f"@atcupps Please investigate why the {table_name} table {problem}."
     assignees = ["atcupps"]
 
     url = f"https://api.github.com/repos/{repo}/issues"
@@ -35,44 +68,113 @@ def send_alert(table_name: str):
         print(response.json())
         exit(1)
 
+def count_rows(client, table: str, column: str) -> int:
+    # `head` only computes the count, without returning any rows
+    return execute_with_retry(client.table(table).select(column, count="exact", head=True)).count
+
 def verify_supabase_populated():
     """
-    Checks that all tables have a lot of rows. The amount is arbitrarily chosen
-    based on what is considered to be a reasonable amount and may require
-    manual adjustment. This should probably be replaced with better CI that
-    randomly checks classes on Testudo to make sure they are in the DB.
+    Checks that all tables have a lot of rows, counting them concurrently.
     """
     client = get_supabase_client()
-    rows = client.table("courses").select("course_code", count="exact").execute()
-    length = rows.count
-    print(f"Found {length} rows in courses table.")
-    if not rows or rows.count < 2000:
-        print(f"Table courses is not populated with enough data ({length} < 2000). Something must be wrong.")
-        send_alert("table")
-        exit(1)
-    rows = client.table("sections").select("course_code, sec_code", count="exact").execute()
-    length = rows.count
-    print(f"Found {length} rows in sections table.")
-    if not rows or rows.count < 6000:
-        print(f"Table sections is not populated with enough data ({length} < 6000). Something must be wrong.")
-        send_alert("sections")
-        exit(1)
-    rows = client.table("instructors").select("*", count="exact").execute()
-    length = rows.count
-    print(f"Found {length} rows in instructors table.")
-    if not rows or rows.count < 13000:
-        print(f"Table instructors is not populated with enough data ({length} < 13000). Something must be wrong.")
-        send_alert("instructors")
-        exit(1)
-    rows = client.table("active_instructors").select("*", count="exact").execute()
-    length = rows.count
-    print(f"Found {length} rows in active_instructors table.")
-    if not rows or rows.count < 2000:
-        print(f"Table active_instructors is not populated with enough data ({length} < 2000). Something must be wrong.")
-        send_alert("active_instructors")
-        exit(1)
+    with ThreadPoolExecutor(max_workers=len(MIN_ROWS)) as executor:
+        counts = {
+            table: executor.submit(count_rows, client, table, column)
+            for (table, (column, _)) in MIN_ROWS.items()
+        }
+        counts = {table: future.result() for (table, future) in counts.items()}
+
+    for (table, (_, minimum)) in MIN_ROWS.items():
+        length = counts[table]
+        print(f"Found {length} rows in {table} table.")
+        if not length or length < minimum:
+            print(f"Table {table} is not populated with enough data ({length} < {minimum}). Something must be wrong.")
+            send_alert(table)
+            exit(1)
 
     print("Successfully verified all tables.")
 
+def compare_chunk(client, chunk: list[str], term: str, deadline: float):
+    """
+    Re-scrapes the sections of the courses in `chunk` from Testudo and compares
+    them with the DB. Returns the number of sections checked and the keys of
+    those missing from the DB, extra in the DB and different.
+    """
+    if time.monotonic() > deadline:
+        # Not started within the time budget; don't query the DB either
+        raise fetch.DeadlineExceeded(f"Deadline passed before comparing {chunk[0]} to {chunk[-1]}")
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        # Read the DB while Testudo is being scraped
+        db_rows = executor.submit(
+            lambda: execute_with_retry(client.table("sections").select(','.join(SECTION_COLUMNS))
+                                       .in_("course_code", chunk)).data)
+        scraped = as_rows(get_sections_for_chunk(chunk, term))
+        db_rows = db_rows.result()
+
+    def key(row):
+        return (row["course_code"], row["sec_code"])
+    scraped = {key(row): row_hash(row, SECTION_COLUMNS) for row in scraped}
+    stored = {key(row): row_hash(row, SECTION_COLUMNS) for row in db_rows}
+    missing = [k for k in scraped if k not in stored]
+    extra = [k for k in stored if k not in scraped]
+    changed = [k for k in scraped if k in stored and scraped[k] != stored[k]]
+    return (len(scraped.keys() | stored.keys()), missing, extra, changed)
+
+def verify_sample(term: str, sample_size: int, max_stale: float, time_budget: float):
+    """
+    Compares the sections of `sample_size` random courses in the DB with
+    Testudo, a few courses per request with several requests in flight, and
+    alerts if more than `max_stale` of the sampled sections are out of date.
+    Courses not compared within `time_budget` seconds are skipped.
+    """
+    deadline = time.monotonic() + time_budget
+    # Testudo requests still running at the deadline fail then, rather than
+    # keeping the process alive until their own timeouts and retries end
+    fetch.set_deadline(deadline)
+    client = get_supabase_client()
+    course_codes = [course["course_code"] for course in download_course_codes(None)]
+    sample = sorted(random.sample(course_codes, min(sample_size, len(course_codes))))
+    chunks = split_into_chunks(sample, SAMPLE_CHUNK_SIZE, term)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(compare_chunk, client, chunk, term, deadline) for chunk in chunks]
+        wait(futures)
+
+    checked = 0
+    skipped = 0
+    stale = {"missing": [], "extra": [], "changed": []}
+    for future in futures:
+        try:
+            (num_sections, missing, extra, changed) = future.result()
+        except fetch.DeadlineExceeded:
+            skipped += 1
+            continue
+        checked += num_sections
+        stale["missing"] += missing
+        stale["extra"] += extra
+        stale["changed"] += changed
+    if skipped:
+        print(f"Time budget exceeded; skipped {skipped} of {len(chunks)} chunks of sampled courses.")
+
+    num_stale = sum(len(keys) for keys in stale.values())
+    fraction = num_stale / checked if checked else 0.0
+    print(f"Sections staleness: {num_stale} of {checked} sampled sections out of date ({fraction:.1%}): "
+          f"{len(stale['missing'])} missing, {len(stale['extra'])} extra, {len(stale['changed'])} changed.")
+    for (kind, keys) in stale.items():
+        for (course_code, sec_code) in keys[:10]:
+            print(f"\t{kind}: {course_code} {sec_code}")
+    if fraction > max_stale:
+        print(f"Table sections is out of date with Testudo ({fraction:.1%} > {max_stale:.1%}). Something must be wrong.")
+        send_alert("sections", problem="is out of date with Testudo")
+        exit(1)
+
+    print("Successfully verified sampled sections.")
+
 if __name__ == "__main__":
-    verify_supabase_populated()
\ No newline at end of file
+    args = parse_args()
+    verify_supabase_populated()
+    if args.sample:
+        if not args.term:
+            print("--term is required with --sample.")
+            exit(1)
+        verify_sample(args.term, args.sample, args.max_stale, args.time_budget)
@@ -1,28 +1,31 @@
-from bs4 import BeautifulSoup
+from __future__ import annotations
 from concurrent.futures import ThreadPoolExecutor
-from functools import partial
+import fetch
+from metrics import metrics
+from parsing import make_soup, make_parse_pool, index_by_id
+from pipeline import map_isolating_failures, fair_share
 from progress import CourseScrapingProgress
-import requests
-
-# Logging progress
-course_progress = CourseScrapingProgress(interval=5)
-
-# Attempts to send the request a total of 3 times by default.
-# Testudo can be flaky sometimes.
-def send_request(uri: str, attempts_remaining=2) -> BeautifulSoup:
-    headers = {
-        "User-Agent": "Mozilla/5.0",
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
-
-    response = requests.post(uri, headers=headers)
-    if response.status_code != 200:
-        if attempts_remaining > 0:
-            return send_request(uri, attempts_remaining - 1)
-        else:
-            raise Exception(f"Failed to fetch data: {response.status_code}")
-    
-    return BeautifulSoup(response.text, features='html.parser')
+from records import Course, as_rows
+from sys import intern
+import threading
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
+
+# Logging progress, created on first use
+_course_progress = None
+_course_progress_lock = threading.Lock()
+
+def get_course_progress() -> CourseScrapingProgress:
+    global _course_progress
+    with _course_progress_lock:
+        if _course_progress is None:
+            _course_progress = CourseScrapingProgress(interval=5)
+        return _course_progress
+
+def send_request(uri: str) -> BeautifulSoup:
+    return make_soup(fetch.send_request(uri))
 
 def get_depts():
     soup = send_request("https://app.testudo.umd.edu/soc")
@@ -31,15 +34,18 @@ def get_depts():
             soup.select("#course-prefixes-page .two")))
     return depts
 
-def course_info(course: str, course_doc: BeautifulSoup):
+def course_info(course: str, course_divs: dict):
+    # Only query within this course's subtree, not the whole department page
+    course_div = course_divs[course]
+
     # Title of course
-    title = course_doc.select_one(f"#{course} .course-title").get_text()
+    title = course_div.select_one(".course-title").get_text()
     
     # Min credits; also used as default for set number of credits
-    min_credits = int(course_doc.select_one(f"#{course} .course-min-credits").get_text())
+    min_credits = int(course_div.select_one(".course-min-credits").get_text())
     
     # Max credits; if not a range, there is no max
-    max_credits_raw = course_doc.select_one(f"#{course} .course-max-credits")
+    max_credits_raw = course_div.select_one(".course-max-credits")
     if max_credits_raw is None:
         max_credits = None
     else:
@@ -47,64 +53,193 @@ def course_info(course: str, course_doc: BeautifulSoup):
     
     # GenEds
     gen_eds = list(
-        map(lambda x: x.get_text(),
-            course_doc.select(f"#{course} .course-subcategory a")))
+        map(lambda x: intern(x.get_text()),
+            course_div.select(".course-subcategory a")))
     if len(gen_eds) == 0:
         gen_eds = None
 
     # Conditions (e.g. prerequisites)
     conditions = list(
         map(lambda x: x.get_text(),
-            course_doc.select(f"#{course} .approved-course-texts-container :nth-child(1) .approved-course-text > div > div > div")))
+            course_div.select(".approved-course-texts-container :nth-child(1) .approved-course-text > div > div > div")))
     if len(conditions) == 0:
         conditions = None
     
     # Course description
-    description_raw = course_doc.select_one(f"#{course} .approved-course-texts-container :nth-child(2) .approved-course-text")
+    description_raw = course_div.select_one(".approved-course-texts-container :nth-child(2) .approved-course-text")
     if description_raw is None:
-        description_raw = course_doc.select_one(f"#{course} .approved-course-text")
+        description_raw = course_div.select_one(".approved-course-text")
     if description_raw is None:
-        description_raw = course_doc.select_one(f"#{course} .course-text")
+        description_raw = course_div.select_one(".course-text")
     description = None if description_raw is None else description_raw.get_text()
 
-    course_progress.increment_courses_parsed()
+    return Course(
+        course_code=intern(course),
+        name=title,
+        min_credits=min_credits,
+        max_credits=max_credits,
+        gen_eds=gen_eds,
+        conditions=conditions,
+        description=description,
+    )
+
+def dept_url(dept: str, term: str):
+    return f"https://app.testudo.umd.edu/soc/{term}/{dept}"
+
+def get_courses_for_dept(dept: str, term: str, parse_pool=None, cache=None, checkpoint=None):
+    '''
+    If `parse_pool` is given, the page is parsed in that process pool instead
+    of the current thread. If `cache` is given, the page is revalidated
+    against it and previous results are reused if the page is unchanged. If
+    `checkpoint` is given, the results are recorded in it, and taken from it
+    without any request when resuming.
+    '''
+    label = get_course_progress().label(dept, term)
+    url = dept_url(dept, term)
+    if checkpoint is not None and (rows := checkpoint.get(url)) is not None:
+        result = [Course.from_dict(row) for row in rows]
+        record_dept_result(label, result)
+        return result
+
+    try:
+        result = scrape_dept(dept, term, parse_pool=parse_pool, cache=cache)
+    except Exception:
+        get_course_progress().mark_dept_failed(label)
+        raise
+    if checkpoint is not None:
+        checkpoint.store(url, as_rows(result))
+    return result
+
+def scrape_dept(dept: str, term: str, parse_pool=None, cache=None):
+    label = get_course_progress().label(dept, term)
+    get_course_progress().mark_dept_sending_req(label)
+    url = dept_url(dept, term)
+    if cache is None:
+        page = fetch.send_request(url)
+    else:
+        entry = cache.get(url)
+        (page, headers) = fetch.send_conditional_request(url, cache.validators(entry))
+        rows = cache.reuse(entry, page)
+        if rows is not None:
+            result = [Course.from_dict(row) for row in rows]
+            record_dept_result(label, result)
+            return result
+        if page is None:
+            # 304 for an entry that has since been evicted
+            page = fetch.send_request(url)
+
+    with metrics.time("parse_seconds", label, kind="dept"):
+        if parse_pool is None:
+            result = parse_dept_page(dept, page, term=term)
+        else:
+            # Progress can't be tracked from another process; count the results here
+            get_course_progress().mark_dept_parsing(label)
+            result = parse_pool.submit(parse_dept_page, dept, page, track_progress=False).result()
+            record_dept_result(label, result)
 
-    return {
-        "course_code": course,
-        "name": title,
-        "min_credits": min_credits,
-        "max_credits": max_credits,
-        "gen_eds": gen_eds,
-        "conditions": conditions,
-        "description": description,
-    }
+    if cache is not None:
+        cache.store(url, page, headers, as_rows(result))
+    return result
 
-def get_courses_for_dept(dept: str, term: str):
-    course_progress.mark_dept_sending_req(dept)
-    course_doc = send_request(f"https://app.testudo.umd.edu/soc/{term}/{dept}")
-    course_progress.mark_dept_parsing(dept)
+def record_dept_result(label: str, result):
+    '''
+    Updates progress for a department whose results were not parsed in this
+    process. `label` is from `get_course_progress().label`.
+    '''
+    get_course_progress().mark_dept_parsing(label)
+    get_course_progress().increment_courses_resolved(len(result))
+    get_course_progress().increment_courses_parsed(len(result))
+    get_course_progress().mark_dept_complete(label)
+
+def parse_dept_page(dept: str, page: str, track_progress=True, term=None):
+    label = get_course_progress().label(dept, term)
+    if track_progress:
+        get_course_progress().mark_dept_parsing(label)
+    course_doc = make_soup(page)
 
     # Get all course IDs
     course_ids = list(
         map(lambda x: x.get_text(),
             course_doc.find_all(class_="course-id")))
-    course_progress.increment_courses_resolved(len(course_ids))
+    if track_progress:
+        get_course_progress().increment_courses_resolved(len(course_ids))
 
     # Get all course info and return
-    course_info_fn_with_docs = partial(course_info, course_doc=course_doc)
-    result = list(map(course_info_fn_with_docs, course_ids))
+    course_divs = index_by_id(course_doc, course_ids, name=None)
+    result = []
+    for course in course_ids:
+        result.append(course_info(course, course_divs))
+        if track_progress:
+            get_course_progress().increment_courses_parsed()
+
+    # Release the tree now rather than whenever it is garbage collected
+    course_doc.decompose()
 
-    course_progress.mark_dept_complete(dept)
+    if track_progress:
+        get_course_progress().mark_dept_complete(label)
     return result
 
-def scrape_courses(term: str, dept: str):
+def scrape_courses(term: str, dept: str, parse_processes=0, cache=None):
+    '''
+    `parse_processes`: if nonzero, parse pages in this many processes while
+    threads do the fetching
+
+    `cache`: optional `ResponseCache` of previously parsed department pages
+    '''
+    return list(iter_courses(term, dept, parse_processes=parse_processes, cache=cache))
+
+def scrape_courses_for_terms(terms: list[str], dept: str, parse_processes=0, cache=None, select_depts=None,
+                             checkpoint=None):
+    '''
+    Like `scrape_courses`, but for several terms at once. Returns a dict of
+    each term's courses.
+    '''
+    result = {term: [] for term in terms}
+    for (term, courses) in iter_courses_for_terms(terms, dept, parse_processes=parse_processes, cache=cache,
+                                                  select_depts=select_depts, checkpoint=checkpoint):
+        result[term] += courses
+    return result
+
+def iter_courses(term: str, dept: str, parse_processes=0, cache=None):
+    '''
+    Generator version of `scrape_courses`, yielding courses one department at
+    a time as they are parsed. Only a few departments are fetched ahead of the
+    consumer.
+    '''
+    for (_, courses) in iter_courses_for_terms([term], dept, parse_processes=parse_processes, cache=cache):
+        yield from courses
+
+def iter_courses_for_terms(terms: list[str], dept: str, parse_processes=0, cache=None, select_depts=None,
+                           checkpoint=None):
+    '''
+    Yields `(term, courses)` for each department page of each term. The
+    departments are only looked up once, and all terms share the same workers,
+    with requests alternating between terms.
+
+    `select_depts`: optional function narrowing down the list of departments,
+    e.g. `Shard.select_depts`
+
+    A department that fails doesn't stop the others; it is retried at the end,
+    and `UnitsFailedError` is raised if it still fails.
+    '''
     depts = [dept] if dept else get_depts()
-    course_progress.total_depts = len(depts)
-    get_courses_for_dept_with_term = partial(get_courses_for_dept, term=term)
+    if select_depts is not None:
+        depts = select_depts(depts)
+    get_course_progress().reset()
+    get_course_progress().multi_term = len(terms) > 1
+    get_course_progress().total_depts = len(depts) * len(terms)
     workers = 4
-    course_progress.start_logging(num_workers=workers)
-    with ThreadPoolExecutor(max_workers=workers) as executor:
-        courses_lists = list(executor.map(get_courses_for_dept_with_term, depts))
-    course_progress.stop_logging()
-    courses = [course for sublist in courses_lists for course in sublist]
-    return courses
\ No newline at end of file
+    fetch.get_session(pool_size=workers)
+    get_course_progress().start_logging(num_workers=workers, request_stats=fetch.request_stats)
+    try:
+        with make_parse_pool(parse_processes) as parse_pool:
+            def get_courses(item):
+                (term, dept) = item
+                return (term, get_courses_for_dept(dept, term, parse_pool=parse_pool, cache=cache,
+                                                   checkpoint=checkpoint))
+            items = fair_share({term: depts for term in terms})
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                yield from map_isolating_failures(executor, get_courses, items, max_pending=2 * workers,
+                                                  describe=lambda item: dept_url(item[1], item[0]))
+    finally:
+        get_course_progress().stop_logging()
@@ -0,0 +1,143 @@
+import argparse
+import random
+import signal
+import threading
+import time
+import traceback
+
+# Long-running alternative to starting `main.py` from cron for every job: the
+# HTTP session, Supabase client, course codes and page cache stay warm between
+# runs, and each of the courses, sections and instructors jobs is scheduled
+# on its own interval.
+
+class Job:
+    '''
+    A job that runs every `interval` seconds plus up to `jitter` seconds. A
+    run is skipped rather than started while the previous one is still going.
+    '''
+    def __init__(self, name: str, interval: float, jitter: float, fn):
+        self.name = name
+        self.interval = interval
+        self.jitter = jitter
+        self.fn = fn
+        self.next_run = time.monotonic()
+        self.thread = None
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def schedule_next(self):
+        self.next_run = time.monotonic() + self.interval + random.uniform(0, self.jitter)
+
+    def start(self):
+        self.schedule_next()
+        self.thread = threading.Thread(target=self._run, name=self.name)
+        self.thread.start()
+
+    def _run(self):
+        print(f"Starting {self.name} job.")
+        start = time.perf_counter()
+        try:
+            self.fn()
+            print(f"Finished {self.name} job in {time.perf_counter() - start:.0f} seconds.")
+        except Exception:
+            # Keep the daemon alive; the job will be retried at its next run
+            print(f"Job {self.name} failed:")
+            traceback.print_exc()
+
+class CourseCodes:
+    '''
+    Each term's course codes from the latest courses run or download, so that
+    sections runs don't need to download them from the DB every time. Codes
+    older than `max_age` seconds are dropped, so that sections runs pick up
+    courses added by a courses run elsewhere (e.g. another cron job).
+    '''
+    def __init__(self, max_age: float):
+        self.max_age = max_age
+        self.course_codes = None
+        self.updated = 0.0
+
+    def get(self):
+        if self.course_codes is None or time.monotonic() - self.updated > self.max_age:
+            return None
+        return self.course_codes
+
+    def set(self, course_codes):
+        self.course_codes = course_codes
+        self.updated = time.monotonic()
+
+def make_jobs(args, cache, run_once):
+    '''
+    The jobs enabled in `args`. `run_once`: `main.run_once`, called with a copy
+    of `args` enabling one job
+    '''
+    course_codes = CourseCodes(args.snapshot_max_age * 60)
+    # Jobs share the progress displays, the metrics registry (reset at the end
+    # of each run) and the checkpoint directory (cleared at the end of each
+    # run), so only one runs at a time
+    run_lock = threading.Lock()
+
+    def job_args(**flags):
+        job = argparse.Namespace(**vars(args))
+        job.courses = job.sections = job.instructors = False
+        for (flag, value) in flags.items():
+            setattr(job, flag, value)
+        return job
+
+    def courses_job():
+        with run_lock:
+            course_codes.set(run_once(job_args(courses=True), cache))
+
+    def sections_job():
+        with run_lock:
+            known = course_codes.get()
+            used = run_once(job_args(sections=True), cache, known)
+            if known is None:
+                # Downloaded from the DB by this run
+                course_codes.set(used)
+
+    def instructors_job():
+        with run_lock:
+            run_once(job_args(instructors=True), cache)
+
+    jobs = []
+    if args.courses:
+        jobs.append(Job("courses", args.courses_interval * 60, args.jitter, courses_job))
+    if args.sections:
+        jobs.append(Job("sections", args.sections_interval * 60, args.jitter, sections_job))
+    if args.instructors:
+        jobs.append(Job("instructors", args.instructors_interval * 60, args.jitter, instructors_job))
+    return jobs
+
+def run_daemon(args, cache, run_once):
+    '''
+    `run_once`: `main.run_once`, called with a copy of `args` enabling one job
+    '''
+    jobs = make_jobs(args, cache, run_once)
+    if not jobs:
+        print("No jobs enabled; pass --courses, --sections and/or --instructors.")
+        return
+
+    stopping = threading.Event()
+    def stop(signum, frame):
+        print("Shutting down after running jobs finish...")
+        stopping.set()
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    while not stopping.is_set():
+        now = time.monotonic()
+        for job in jobs:
+            if now < job.next_run:
+                continue
+            if job.is_running():
+                print(f"Skipping {job.name} job; previous run is still in progress.")
+                job.schedule_next()
+            else:
+                job.start()
+        next_run = min(job.next_run for job in jobs)
+        stopping.wait(max(0.0, min(next_run - time.monotonic(), 60.0)))
+
+    for job in jobs:
+        if job.thread is not None:
+            job.thread.join()
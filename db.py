@@ -1,61 +1,383 @@
-from tabulate import tabulate
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
 import os
-from supabase import create_client, Client
-import textwrap
+import random
+import threading
+import time
+from typing import TYPE_CHECKING
+from records import as_row, as_rows
+from metrics import metrics
+from output import print_rows, snapshot_rows
+
+# `supabase` takes long to import and isn't needed until the first DB request
+if TYPE_CHECKING:
+    from supabase import Client
+
+_client = None
+_client_lock = threading.Lock()
 
 def get_supabase_client() -> Client:
-    url = os.getenv("DATABASE_URL")
-    key = os.getenv("DATABASE_KEY")
-    if not url or not key:
-        raise EnvironmentError("DATABASE_URL or DATABASE_KEY not set in environment")
-    return create_client(url, key)
-
-def print_as_table(data, wrap_width=36):
-    if not data:
-        print("No data found.")
-        return
-
-    # Wrap long values in each row
-    wrapped_data = []
-    for item in data:
-        wrapped_item = {
-            key: textwrap.fill(str(value), width=wrap_width)
-            for key, value in item.items()
-        }
-        wrapped_data.append(wrapped_item)
-
-    headers = wrapped_data[0].keys()
-    rows = [item.values() for item in wrapped_data]
-    print(tabulate(rows, headers=headers, tablefmt="grid"))
-
-def upload_data(data, print_output, table):
-    '''
-    Doesn't upload if `print_output` is enabled
     '''
+    Returns a client shared by all callers, created on first use.
+    '''
+    from supabase import create_client
+
+    global _client
+    with _client_lock:
+        if _client is None:
+            url = os.getenv("DATABASE_URL")
+            key = os.getenv("DATABASE_KEY")
+            if not url or not key:
+                raise EnvironmentError("DATABASE_URL or DATABASE_KEY not set in environment")
+            _client = create_client(url, key)
+        return _client
+
+# Rows per insert/upsert request, and number of requests in flight at once
+UPLOAD_BATCH_SIZE = 1000
+UPLOAD_WORKERS = 4
+
+# Unique key of each table, including the per-term and staging tables derived
+# from it (e.g. `sections_202508_staging`). Uploads upsert on it, which needs
+# the unique constraints from `sql/table_keys.sql`.
+TABLE_KEYS = {
+    "courses": ("course_code",),
+    "sections": ("course_code", "sec_code"),
+    "instructors": ("slug",),
+}
+
+def table_key(table: str):
+    for (name, key_columns) in TABLE_KEYS.items():
+        if table.startswith(name):
+            return key_columns
+    raise ValueError(f"Unknown table '{table}'")
+
+def split_into_batches(data, batch_size):
+    return [data[i:i + batch_size] for i in range(0, len(data), batch_size)]
+
+def execute_with_retry(request, attempts=4, base_delay=0.5):
+    '''
+    Executes a postgrest request builder, retrying with exponential backoff and
+    jitter if it raises.
+    '''
+    for attempt in range(attempts):
+        start = time.perf_counter()
+        try:
+            response = request.execute()
+            metrics.observe("db_request_seconds", time.perf_counter() - start)
+            return response
+        except Exception:
+            metrics.increment("db_errors_total")
+            if attempt == attempts - 1:
+                raise
+            metrics.increment("db_retries_total")
+            time.sleep(base_delay * (2 ** attempt) * (1 + random.random()))
+
+def upload_batches(client: Client, table: str, data, upsert_on=None,
+                   batch_size=UPLOAD_BATCH_SIZE, workers=UPLOAD_WORKERS):
+    '''
+    Uploads `data` to `table` in batches of `batch_size` rows with up to
+    `workers` batches in flight over the shared `client`. Rows are upserted on
+    conflict with `upsert_on` (the table's key by default), so that retrying a
+    batch the DB already committed doesn't duplicate it or fail.
+    '''
+    upsert_on = upsert_on or ','.join(table_key(table))
+
+    def upload_batch(batch):
+        execute_with_retry(client.table(table).upsert(batch, on_conflict=upsert_on))
+        metrics.increment("uploaded_rows_total", len(batch), table=table)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # `list` so that an exception in any batch is raised here
+        list(executor.map(upload_batch, split_into_batches(data, batch_size)))
+
+def upload_data(data, print_output, table, batch_size=UPLOAD_BATCH_SIZE,
+                workers=UPLOAD_WORKERS, staging=False):
+    '''
+    Doesn't upload if `print_output` is enabled. `data` may contain records
+    from `records`, which are converted to dicts here. Rows are also recorded
+    in the snapshot, if any (see `output.set_snapshot_dir`).
+
+    If `staging` is enabled, rows are written to `<table>_staging` and then
+    swapped into `table` in a single transaction by the `swap_staging` DB
+    function (see `sql/swap_staging.sql`), so readers never see a partially
+    written table.
+    '''
+    data = list(snapshot_rows(table, as_rows(data)))
     if print_output:
-        print_as_table(data)
+        print_rows(data, table)
     else:
-        client = get_supabase_client()
+        with metrics.time("upload_seconds", table):
+            client = get_supabase_client()
+            comparison_col = table_key(table)[0]
+            target = f"{table}_staging" if staging else table
+
+            # Delete all current data to avoid having stale data
+            execute_with_retry(client.table(target).delete().neq(comparison_col, 0))
+
+            # Upload data
+            upload_batches(client, target, data, batch_size=batch_size, workers=workers)
+
+            if staging:
+                execute_with_retry(client.rpc("swap_staging", {"target": table}))
+
+def upload_stream(rows, print_output, table, batch_size=UPLOAD_BATCH_SIZE, workers=UPLOAD_WORKERS,
+                  staging=False):
+    '''
+    Like `upload_data`, but consumes `rows` from an iterator and uploads each
+    batch as soon as it is full, so uploading overlaps with scraping and only
+    a bounded number of batches are held in memory at once. Returns the number
+    of rows uploaded.
+
+    Without `staging`, `table` is emptied before the first row arrives and
+    left partly written if scraping fails, so `main.py` only streams into
+    staging tables.
+    '''
+    rows = snapshot_rows(table, map(as_row, rows))
+    if print_output:
+        return print_rows(rows, table)
+
+    start = time.perf_counter()
+    client = get_supabase_client()
+    comparison_col = table_key(table)[0]
+    target = f"{table}_staging" if staging else table
+    execute_with_retry(client.table(target).delete().neq(comparison_col, 0))
+    upsert_on = ','.join(table_key(table))
+
+    # Blocks the producer while `2 * workers` batches are queued or in flight
+    slots = threading.Semaphore(2 * workers)
+
+    def upload_batch(batch):
+        try:
+            # Upserted, like in `upload_batches`, so that retries are idempotent
+            execute_with_retry(client.table(target).upsert(batch, on_conflict=upsert_on))
+            metrics.increment("uploaded_rows_total", len(batch), table=table)
+        finally:
+            slots.release()
+
+    count = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                slots.acquire()
+                futures.append(executor.submit(upload_batch, batch))
+                count += len(batch)
+                batch = []
+        if batch:
+            slots.acquire()
+            futures.append(executor.submit(upload_batch, batch))
+            count += len(batch)
+        for future in futures:
+            future.result()
 
-        # Delete all current data to avoid having stale data
-        comparison_col = 'course_code' if table != 'instructors' else 'slug'
-        client.table(table).delete().neq(comparison_col, 0).execute()
+    if staging:
+        execute_with_retry(client.rpc("swap_staging", {"target": table}))
+    # Includes time spent waiting on the scraper for rows
+    metrics.record_timing("upload_seconds", table, time.perf_counter() - start)
+    return count
 
-        # Upload data
-        client.table(table).insert(data).execute()
+def row_hash(row: dict, columns) -> str:
+    '''
+    Hash of the given `columns` of `row`, used to detect changed rows without
+    comparing them field by field.
+    '''
+    # Sorted keys, since jsonb columns don't keep the key order they were uploaded with
+    content = json.dumps([row.get(col) for col in columns], separators=(',', ':'), sort_keys=True)
+    return hashlib.sha1(content.encode()).hexdigest()
 
-def download_course_codes(dept_opt: str | None):
-    # Continues to send requests until the API returns less than 500.
-    full_courses = []
+def download_rows(client: Client, table: str, columns: str, order_by, page_size=1000,
+                  in_column=None, in_values=None):
+    # Supabase caps the number of rows per response, so read in pages,
+    # ordered by `order_by` so that pages don't overlap or skip rows. With
+    # `in_column`, only rows whose `in_column` is in `in_values` are read.
+    full_rows = []
     offset = 0
-    response_full = True
+    while True:
+        request = client.table(table).select(columns)
+        if in_column is not None:
+            request = request.in_(in_column, in_values)
+        for col in order_by:
+            request = request.order(col)
+        rows = request.range(offset, offset + page_size - 1).execute().data
+        full_rows += rows
+        offset += len(rows)
+        if len(rows) < page_size:
+            return full_rows
+
+def sync_table(data, print_output, table, key_columns, batch_size=UPLOAD_BATCH_SIZE, workers=UPLOAD_WORKERS,
+               scope_column=None, scope_values=None):
+    '''
+    Incrementally syncs `table` with the DB: rows are keyed by `key_columns`,
+    only new or changed rows are upserted and rows that no longer exist are
+    deleted. Unlike `upload_data`, the table is never empty while syncing.
+    Returns the counts of inserted, updated, deleted and unchanged rows.
+
+    If `scope_column` is given, `data` only covers existing rows whose
+    `scope_column` is in `scope_values`; other rows are left untouched.
+    '''
+    data = as_rows(data)
+    if print_output:
+        upload_data(data, print_output, table=table)
+        return None
+    if not data and scope_column is None:
+        # Without a scope, there's nothing to compare empty data against
+        upload_data(data, print_output, table=table)
+        return None
+    if scope_column is None:
+        # A scoped sync only covers part of the table, so isn't snapshotted
+        data = list(snapshot_rows(table, data))
+
+    start = time.perf_counter()
+    columns = list(data[0].keys()) if data else list(key_columns)
+    if scope_column is not None and scope_column not in columns:
+        columns.append(scope_column)
+    client = get_supabase_client()
+    if scope_column is None:
+        existing_rows = download_rows(client, table, ','.join(columns), key_columns)
+    else:
+        # Only download rows in scope, bounding the length of the `in` filter
+        # in the request URL
+        def download_scope(values):
+            return download_rows(client, table, ','.join(columns), key_columns,
+                                 in_column=scope_column, in_values=values)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pages = executor.map(download_scope, split_into_batches(sorted(set(scope_values)), 200))
+            existing_rows = [row for page in pages for row in page]
+    existing = {tuple(row[col] for col in key_columns): row_hash(row, columns) for row in existing_rows}
+
+    counts = {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": 0}
+    changed = []
+    seen = set()
+    for row in data:
+        key = tuple(row[col] for col in key_columns)
+        seen.add(key)
+        old_hash = existing.get(key)
+        if old_hash is None:
+            counts["inserted"] += 1
+            changed.append(row)
+        elif old_hash != row_hash(row, columns):
+            counts["updated"] += 1
+            changed.append(row)
+        else:
+            counts["unchanged"] += 1
+
+    if changed:
+        upload_batches(client, table, changed, upsert_on=','.join(key_columns),
+                       batch_size=batch_size, workers=workers)
+
+    # Group vanished rows by all but the last key column (e.g. sections by
+    # course) so that each group needs few requests
+    vanished = dict()
+    for key in existing.keys() - seen:
+        vanished.setdefault(key[:-1], []).append(key[-1])
+    for prefix, last_values in vanished.items():
+        # Bound the length of the `in` filter in the request URL
+        for values in split_into_batches(last_values, 200):
+            request = client.table(table).delete()
+            for col, value in zip(key_columns, prefix):
+                request = request.eq(col, value)
+            execute_with_retry(request.in_(key_columns[-1], values))
+        counts["deleted"] += len(last_values)
+
+    metrics.record_timing("upload_seconds", table, time.perf_counter() - start)
+    for (change, count) in counts.items():
+        metrics.increment("synced_rows_total", count, table=table, change=change)
+    print(f"Synced {table}: {counts['inserted']} inserted, {counts['updated']} updated, "
+          f"{counts['deleted']} deleted, {counts['unchanged']} unchanged.")
+    return counts
+
+def sync_sections(data, print_output, batch_size=UPLOAD_BATCH_SIZE, workers=UPLOAD_WORKERS, course_codes=None,
+                  table='sections'):
+    '''
+    If `course_codes` is given, only sections of those courses are synced.
+    '''
+    if course_codes is None:
+        return sync_table(data, print_output, table, table_key(table),
+                          batch_size=batch_size, workers=workers)
+    return sync_table(data, print_output, table, table_key(table),
+                      batch_size=batch_size, workers=workers,
+                      scope_column='course_code', scope_values=course_codes)
+
+def sync_instructors(data, print_output, batch_size=UPLOAD_BATCH_SIZE, workers=UPLOAD_WORKERS, table='instructors'):
+    return sync_table(data, print_output, table, table_key(table),
+                      batch_size=batch_size, workers=workers)
+
+# Rows per request when downloading course codes
+COURSE_CODES_PAGE_SIZE = 500
+
+def term_table(table: str, term: str, primary_term: str) -> str:
+    '''
+    Table holding the rows of `table` for `term`: `table` itself for the
+    primary term, and `<table>_<term>` for any other term.
+    '''
+    return table if term == primary_term else f"{table}_{term}"
+
+def count_course_codes(client: Client, dept: str, table="courses") -> int:
+    # `head` skips returning rows; only the count is computed
+    return execute_with_retry(client.table(table).select("course_code", count="exact", head=True)
+                              .ilike("course_code", f"{dept}*")).count
+
+def download_course_codes(dept_opt: str | None, snapshot_path=None, max_snapshot_age=3600.0, workers=4,
+                          table="courses"):
+    '''
+    Downloads the codes of all courses (in `dept_opt` if given) from `table`,
+    fetching pages in parallel once the total count is known.
+
+    If `snapshot_path` is given, the list is also saved there, and reused
+    instead of downloading it again if the snapshot is younger than
+    `max_snapshot_age` seconds and the DB still has the same number of courses.
+    '''
     dept = dept_opt if dept_opt else ""
     client = get_supabase_client()
-    while response_full:
-        print(f"Getting courses from DB with offset: {offset}")
-        courses = client.table("courses").select("course_code").ilike("course_code", f"{dept}*").range(offset, offset + 499).execute().data
-        full_courses += courses
-        offset += len(courses)
-        if len(courses) < 500:
-            response_full = False
+    total = count_course_codes(client, dept, table)
+
+    snapshot_key = f"{table}:{dept}"
+    snapshot = load_course_codes_snapshot(snapshot_path, snapshot_key)
+    if snapshot is not None and time.time() - snapshot["time"] < max_snapshot_age \
+            and len(snapshot["course_codes"]) == total:
+        print(f"Using snapshot of {total} course codes from {snapshot_path}.")
+        return [{"course_code": code} for code in snapshot["course_codes"]]
+
+    def download_page(offset):
+        # Ordered so that pages don't overlap or skip rows
+        return execute_with_retry(client.table(table).select("course_code").ilike("course_code", f"{dept}*")
+                                  .order("course_code").range(offset, offset + COURSE_CODES_PAGE_SIZE - 1)).data
+
+    offsets = range(0, total, COURSE_CODES_PAGE_SIZE)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pages = list(executor.map(download_page, offsets))
+    full_courses = [course for page in pages for course in page]
+    print(f"Got {len(full_courses)} course codes from DB in {len(pages)} requests.")
+
+    if snapshot_path:
+        save_course_codes_snapshot(snapshot_path, snapshot_key, [course["course_code"] for course in full_courses])
     return full_courses
+
+def load_course_codes_snapshot(path, key: str):
+    if not path:
+        return None
+    try:
+        with open(path) as f:
+            snapshots = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return snapshots.get(key)
+
+def save_course_codes_snapshot(path: str, key: str, course_codes):
+    try:
+        with open(path) as f:
+            snapshots = json.load(f)
+    except (OSError, ValueError):
+        snapshots = dict()
+    snapshots[key] = {"time": time.time(), "course_codes": course_codes}
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(snapshots, f)
+    os.replace(tmp_path, path)
@@ -0,0 +1,232 @@
+from __future__ import annotations
+from metrics import metrics
+import random
+import threading
+import time
+from typing import TYPE_CHECKING
+
+# `requests` is imported on first use, so that importing this module (e.g. for
+# its defaults) stays cheap
+if TYPE_CHECKING:
+    import requests
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0",
+    "Content-Type": "application/x-www-form-urlencoded"
+}
+
+# (connect, read) timeouts in seconds; Testudo's section pages can be slow.
+DEFAULT_TIMEOUT = (10, 60)
+
+class RequestStats:
+    '''
+    Thread-safe counters for requests sent through `send_request`, displayed
+    by the progress reporters. Everything is also recorded in `metrics`,
+    labeled with `source`.
+    '''
+    def __init__(self, source="testudo"):
+        self.source = source
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def record_request(self, latency: float, num_bytes=0):
+        with self.lock:
+            self.requests += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+        metrics.observe("http_request_seconds", latency, source=self.source)
+        metrics.increment("http_downloaded_bytes_total", num_bytes, source=self.source)
+
+    def record_retry(self):
+        with self.lock:
+            self.retries += 1
+        metrics.increment("http_retries_total", source=self.source)
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+        metrics.increment("http_failures_total", source=self.source)
+
+    def summary(self) -> str:
+        with self.lock:
+            avg = self.total_latency / self.requests if self.requests else 0.0
+            return (f"{self.requests} requests, avg {avg:.2f}s, max {self.max_latency:.2f}s, "
+                    f"{self.retries} retries, {self.failures} failures")
+
+request_stats = RequestStats()
+
+class RateLimiter:
+    '''
+    Token bucket allowing on average `rate` requests per second, with bursts of
+    up to `capacity` requests. `acquire` blocks until a token is available.
+    '''
+    def __init__(self, rate: float, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class RetryableStatus(Exception):
+    pass
+
+class DeadlineExceeded(Exception):
+    pass
+
+_session = None
+_pool_size = 0
+_timeout = DEFAULT_TIMEOUT
+_deadline = None
+_session_lock = threading.Lock()
+_record_dir = None
+_replay_dir = None
+
+def set_fixtures(record_dir=None, replay_dir=None):
+    '''
+    Records all responses to `record_dir`, or serves all requests from the
+    fixtures in `replay_dir` instead of the network. Must be called before the
+    session is first used.
+    '''
+    global _record_dir, _replay_dir
+    _record_dir = record_dir
+    _replay_dir = replay_dir
+
+def set_timeout(connect: float, read: float):
+    global _timeout
+    _timeout = (connect, read)
+
+def get_timeout():
+    return _timeout
+
+def set_deadline(deadline):
+    '''
+    Makes requests raise `DeadlineExceeded` rather than run past `deadline` (a
+    `time.monotonic()` value), or removes the deadline if None. The timeouts
+    and backoff of every attempt are shortened to the time left.
+    '''
+    global _deadline
+    _deadline = deadline
+
+def _time_left(uri: str):
+    # Seconds until the deadline, or None without one
+    if _deadline is None:
+        return None
+    left = _deadline - time.monotonic()
+    if left <= 0:
+        raise DeadlineExceeded(f"Deadline passed before requesting {uri}")
+    return left
+
+def get_session(pool_size=10) -> requests.Session:
+    '''
+    Returns the session shared by all Testudo requests so that connections are
+    kept alive and reused, growing its connection pool to `pool_size` if needed.
+    A `pool_size` of 0 leaves the pool as it is.
+    '''
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    global _session, _pool_size
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            _session.headers.update(HEADERS)
+            if _record_dir:
+                from fixtures import make_recorder
+                _session.hooks["response"].append(make_recorder(_record_dir))
+            if _replay_dir:
+                from fixtures import ReplayAdapter
+                adapter = ReplayAdapter(_replay_dir)
+                _session.mount("https://", adapter)
+                _session.mount("http://", adapter)
+        if pool_size > _pool_size and not _replay_dir:
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+            _pool_size = pool_size
+        return _session
+
+def check_status(status_code: int, stats: RequestStats):
+    '''
+    Raises `RetryableStatus` for 429s and 5xx responses, and a plain
+    `Exception` for any other non-200 response.
+    '''
+    if status_code == 429 or status_code >= 500:
+        raise RetryableStatus(f"Failed to fetch data: {status_code}")
+    if status_code != 200:
+        stats.record_failure()
+        raise Exception(f"Failed to fetch data: {status_code}")
+
+def backoff(attempt: int, base_delay: float, max_delay=30.0):
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+def send_request(uri: str, method="POST", attempts=4, base_delay=1.0, stats=request_stats,
+                 rate_limiter=None) -> str:
+    '''
+    Sends a request and returns the response body. Testudo can be flaky
+    sometimes, so connection errors, timeouts, 429s and 5xx responses are
+    retried up to `attempts` times in total with exponential backoff. Other
+    non-200 responses fail immediately. If `rate_limiter` is given, every
+    attempt waits for it first.
+    '''
+    return _send(uri, method, None, attempts, base_delay, stats, rate_limiter).text
+
+def send_conditional_request(uri: str, headers: dict, method="POST", attempts=4, base_delay=1.0,
+                             stats=request_stats):
+    '''
+    Like `send_request`, but sends the given validator `headers` (e.g.
+    `If-None-Match`) and returns `(body, response_headers)`, where `body` is
+    None if the server answered 304 Not Modified.
+    '''
+    response = _send(uri, method, headers, attempts, base_delay, stats, None)
+    if response.status_code == 304:
+        return (None, response.headers)
+    return (response.text, response.headers)
+
+def _send(uri: str, method: str, headers, attempts: int, base_delay: float, stats: RequestStats,
+          rate_limiter):
+    import requests
+
+    # The pool is sized to the workers by whoever starts them
+    session = get_session(pool_size=0)
+    for attempt in range(attempts):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        timeout = _timeout
+        if (left := _time_left(uri)) is not None:
+            timeout = (min(timeout[0], left), min(timeout[1], left))
+        start = time.perf_counter()
+        try:
+            response = session.request(method, uri, headers=headers, timeout=timeout)
+            stats.record_request(time.perf_counter() - start, len(response.content))
+            if not (headers and response.status_code == 304):
+                check_status(response.status_code, stats)
+            return response
+        except (requests.ConnectionError, requests.Timeout, RetryableStatus) as e:
+            past_deadline = _deadline is not None and time.monotonic() >= _deadline
+            if attempt == attempts - 1 or past_deadline:
+                stats.record_failure()
+                if past_deadline:
+                    raise DeadlineExceeded(f"Deadline passed while requesting {uri}") from e
+                raise
+            stats.record_retry()
+            delay = backoff(attempt, base_delay)
+            if _deadline is not None:
+                delay = max(0.0, min(delay, _deadline - time.monotonic()))
+            time.sleep(delay)
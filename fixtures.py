@@ -0,0 +1,69 @@
+from requests.adapters import BaseAdapter
+import hashlib
+import json
+import os
+import requests
+
+# Recorded responses are stored one per file, keyed by request method and URL,
+# so that scraper runs can be replayed offline (e.g. by `benchmark.py`).
+
+def fixture_path(directory: str, method: str, url: str):
+    key = hashlib.sha1(f"{method} {url}".encode()).hexdigest()
+    return os.path.join(directory, key + ".json")
+
+def make_recorder(directory: str):
+    '''
+    Returns a `requests` response hook that saves each response to `directory`.
+    '''
+    os.makedirs(directory, exist_ok=True)
+
+    def record(response: requests.Response, *args, **kwargs):
+        # Only complete responses are useful to replay
+        if response.status_code != 200:
+            return response
+        request = response.request
+        fixture = {
+            "method": request.method,
+            "url": request.url,
+            "status_code": response.status_code,
+            "headers": {k: v for (k, v) in response.headers.items()
+                        if k in ("Content-Type", "ETag", "Last-Modified")},
+            "body": response.text,
+        }
+        path = fixture_path(directory, request.method, request.url)
+        tmp_path = f"{path}.{os.getpid()}.{id(response)}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(fixture, f)
+        os.replace(tmp_path, path)
+        return response
+
+    return record
+
+class ReplayAdapter(BaseAdapter):
+    '''
+    Transport adapter that answers requests from recorded fixtures instead of
+    the network. Requests without a fixture fail with a 404.
+    '''
+    def __init__(self, directory: str):
+        super().__init__()
+        self.directory = directory
+
+    def send(self, request, **kwargs):
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        response.encoding = "utf-8"
+        try:
+            with open(fixture_path(self.directory, request.method, request.url)) as f:
+                fixture = json.load(f)
+        except FileNotFoundError:
+            response.status_code = 404
+            response._content = b""
+            return response
+        response.status_code = fixture["status_code"]
+        response.headers.update(fixture["headers"])
+        response._content = fixture["body"].encode("utf-8")
+        return response
+
+    def close(self):
+        pass
@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+import time
+
+class RefreshHistory:
+    '''
+    Persisted per-course record of when each course's sections were last
+    refreshed and last changed, used to refresh "hot" courses (ones whose seat
+    counts changed recently, or that are nearly full) more often than the long
+    tail.
+    '''
+    def __init__(self, path: str, courses=None):
+        self.path = path
+        self.courses = courses if courses is not None else dict()
+
+    @classmethod
+    def load(cls, path: str):
+        try:
+            with open(path) as f:
+                return cls(path, json.load(f))
+        except FileNotFoundError:
+            return cls(path)
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.courses, f, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+    def is_hot(self, course: str, now: float, hot_window: float, low_seats: int):
+        entry = self.courses.get(course)
+        if entry is None:
+            return True
+        changed_recently = entry["last_changed"] is not None and now - entry["last_changed"] <= hot_window
+        nearly_full = entry["min_open_seats"] is not None and entry["min_open_seats"] <= low_seats
+        return changed_recently or nearly_full
+
+    def due_courses(self, course_codes, hot_interval: float, cold_interval: float, hot_window=86400.0,
+                    low_seats=5, now=None):
+        '''
+        Courses to refresh now, hot courses first: hot courses not refreshed
+        in the last `hot_interval` seconds and other courses not refreshed in
+        the last `cold_interval` seconds. Courses without history are always
+        due.
+        '''
+        now = time.time() if now is None else now
+        hot = []
+        cold = []
+        for course in course_codes:
+            entry = self.courses.get(course)
+            if self.is_hot(course, now, hot_window, low_seats):
+                if entry is None or now - entry["last_refreshed"] >= hot_interval:
+                    hot.append(course)
+            elif now - entry["last_refreshed"] >= cold_interval:
+                cold.append(course)
+        return hot + cold
+
+    def record(self, course_codes, sections, now=None):
+        '''
+        Records that `course_codes` were refreshed, producing `sections`
+        (`records.Section`s).
+        '''
+        now = time.time() if now is None else now
+        by_course = {course: [] for course in course_codes}
+        for section in sections:
+            by_course.setdefault(section.course_code, []).append(section)
+
+        for (course, course_sections) in by_course.items():
+            seats = sorted((s.sec_code, s.open_seats, s.waitlist) for s in course_sections)
+            seats_hash = hashlib.sha1(json.dumps(seats).encode()).hexdigest()
+            entry = self.courses.get(course)
+            # The first observation of a course isn't a change
+            if entry is None:
+                last_changed = None
+            elif entry["seats_hash"] != seats_hash:
+                last_changed = now
+            else:
+                last_changed = entry["last_changed"]
+            self.courses[course] = {
+                "last_refreshed": now,
+                "last_changed": last_changed,
+                "seats_hash": seats_hash,
+                "min_open_seats": min((s.open_seats for s in course_sections), default=None),
+            }
@@ -1,44 +1,57 @@
-import requests
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor
+from fetch import RateLimiter, RequestStats
+import fetch
+import json
 
-# Send a request to PlanetTerp API; return JSON-parsed list of dicts.
-# Takes limit and offset as parameters to send to API.
-def send_request(term: str, limit: int, offset: int):
-    uri = f"https://planetterp.com/api/v1/professors?type=professor&limit={limit}&offset={offset}"
+# PlanetTerp asks for no more than 2 requests per second, and returns at most
+# 100 professors per request.
+REQUESTS_PER_SECOND = 2
+PAGE_SIZE = 100
 
-    headers = {
-        "User-Agent": "Mozilla/5.0",
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
+planetterp_stats = RequestStats(source="planetterp")
 
-    response = requests.get(uri, headers)
-    if response.status_code != 200:
-        raise Exception(f"Failed to fetch data: {response.status_code}: {response.reason}")
-    
-    return response.json()
+# Send a request to PlanetTerp API; return JSON-parsed list of dicts.
+# Takes limit and offset as parameters to send to API. Retries with backoff
+# like Testudo requests, with every attempt waiting on `rate_limiter`.
+def send_request(term: str, limit: int, offset: int, rate_limiter=None):
+    uri = f"https://planetterp.com/api/v1/professors?type=professor&limit={limit}&offset={offset}"
+    return json.loads(fetch.send_request(uri, method="GET", stats=planetterp_stats, rate_limiter=rate_limiter))
 
-# Gets data on all instructors from PlanetTerp API. Sends requests to get 100
-# instructors at a time, with requests separated by 500 ms as requested by the
-# PlanetTerp team.
-def get_instructors(term: str):
-    # Continues to send requests until the API returns a number of instructors
-    # less than 100.
-    full_instructors = []
-    offset = 0
-    response_full = True
-    while response_full:
-        sleep(0.5)
-        print(f"Getting professors from PlanetTerp API with offset: {offset}")
-        instructors = send_request(term, 100, offset)
-        full_instructors += instructors
-        offset += len(instructors)
-        if len(instructors) < 100:
-            response_full = False
-    
+def parse_instructors(instructors):
     return [
         {
             "slug": i["slug"],
             "name": i["name"],
             "average_rating": i["average_rating"]
-        } for i in full_instructors
-    ]
\ No newline at end of file
+        } for i in instructors
+    ]
+
+# Gets data on all instructors from PlanetTerp API. Requests for the next
+# `workers` pages are kept in flight at once, while the rate limiter keeps them
+# within PlanetTerp's limit; each page is parsed as soon as it arrives.
+def get_instructors(term: str, workers=4, page_size=PAGE_SIZE, rate=REQUESTS_PER_SECOND):
+    rate_limiter = RateLimiter(rate)
+    full_instructors = []
+    offset = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def submit(offset):
+            return executor.submit(send_request, term, page_size, offset, rate_limiter)
+
+        # The total isn't known in advance, so keep requesting pages until one
+        # comes back less than full; requests for pages past the end are
+        # wasted but harmless.
+        pending = [submit(offset + i * page_size) for i in range(workers)]
+        next_offset = offset + workers * page_size
+        while pending:
+            instructors = pending.pop(0).result()
+            print(f"Got {len(instructors)} professors from PlanetTerp API with offset: {offset}")
+            full_instructors += parse_instructors(instructors)
+            offset += page_size
+            if len(instructors) < page_size:
+                for future in pending:
+                    future.cancel()
+                break
+            pending.append(submit(next_offset))
+            next_offset += page_size
+
+    return full_instructors
@@ -1,46 +1,375 @@
 import argparse
-from courses import scrape_courses
-from sections import scrape_sections
+from functools import partial
+from courses import scrape_courses_for_terms, iter_courses_for_terms
+from sections import CHUNK_SIZE, scrape_sections_for_terms, iter_sections_for_terms
 from instructors import get_instructors
-from db import upload_data, download_course_codes
+from db import UPLOAD_BATCH_SIZE, UPLOAD_WORKERS, upload_data, upload_stream, download_course_codes, sync_sections, sync_instructors, term_table
+from parsing import PARSERS, set_parser
+import fetch
+from metrics import metrics
+import output
+from cache import ResponseCache
+from history import RefreshHistory
+from pipeline import demultiplex
+from shards import Shard, ShardWriter, read_shards, save_costs
+from checkpoint import Checkpoint
+from pipelined import scrape_courses_and_sections
+import os
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Scrape Testudo Schedule of Classes")
-    parser.add_argument("--term", help="Term to scrape (e.g., '202508' for Fall 2025)")
+    parser.add_argument("--term", nargs="+", help="Term(s) to scrape (e.g., '202508' for Fall 2025). Several terms are scraped together over the same connections and workers; the first is uploaded to the usual tables and each other term to `<table>_<term>`. Not needed for `--instructors`, which are the same for all terms")
     parser.add_argument("--print-output", action="store_true", help="Output results to stdout instead of uploading to DB")
     parser.add_argument("--department", help="Specific department (e.g., CMSC)")
     parser.add_argument("--courses", action="store_true", help="Scrape, parse, and upload all courses")
     parser.add_argument("--sections", action="store_true", help="Scrape, parse, and upload all sections; if `--courses` is not enabled, uses list of courses already present in courses database")
     parser.add_argument("--instructors", action="store_true", help="Scrape, parse, and upload all instructors from PlanetTerp")
-    return parser.parse_args()
+    parser.add_argument("--incremental", action="store_true", help="Only upsert sections and instructors that changed and delete those that disappeared, instead of replacing the whole table")
+    parser.add_argument("--batch-size", type=int, default=UPLOAD_BATCH_SIZE, help="Number of rows per upload request")
+    parser.add_argument("--upload-workers", type=int, default=UPLOAD_WORKERS, help="Number of upload requests in flight at once")
+    parser.add_argument("--staging", action="store_true", help="Upload into `<table>_staging` and swap it into place atomically (requires `sql/swap_staging.sql`)")
+    parser.add_argument("--timeout", type=float, default=fetch.DEFAULT_TIMEOUT[1], help="Seconds to wait for a Testudo response before retrying")
+    parser.add_argument("--engine", choices=["threads", "async"], default="threads", help="Scrape Testudo with thread pools or with the asyncio engine")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum concurrent Testudo requests with `--engine async`")
+    parser.add_argument("--parse-processes", type=int, default=0, help="Parse Testudo pages in this many processes while threads fetch them (threaded engine only)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Number of courses per sections request")
+    parser.add_argument("--adaptive-chunks", action="store_true", help="Resize section chunks from observed response times, handing them out to workers from a shared queue (threaded engine only)")
+    parser.add_argument("--cache-dir", help="Directory for an on-disk cache of Testudo pages; unchanged pages aren't parsed again")
+    parser.add_argument("--cache-max-mb", type=int, default=200, help="Maximum size of the page cache in megabytes")
+    parser.add_argument("--record", metavar="DIR", help="Save all HTTP responses to DIR as fixtures for `--replay` and `benchmark.py`")
+    parser.add_argument("--replay", metavar="DIR", help="Serve all HTTP requests from fixtures in DIR instead of the network (threaded engine only)")
+    parser.add_argument("--stream", action="store_true", help="Upload rows while scraping instead of collecting them all first (threaded engine only); requires `--staging` when uploading, so the live tables are only replaced once scraping succeeds")
+    parser.add_argument("--targeted", action="store_true", help="Only refresh sections of courses that are due according to `--history`: hot courses every `--hot-interval` minutes, others every `--cold-interval` minutes. Implies incremental sync, limited to those courses")
+    parser.add_argument("--history", default=".cache/refresh_history.json", help="File recording when each course's sections were last refreshed and changed")
+    parser.add_argument("--hot-interval", type=float, default=0, help="Minutes between refreshes of hot courses (changed in the last day, or nearly full)")
+    parser.add_argument("--cold-interval", type=float, default=180, help="Minutes between refreshes of all other courses")
+    parser.add_argument("--daemon", action="store_true", help="Keep running, scraping courses, sections and instructors (whichever are enabled) on their own intervals")
+    parser.add_argument("--courses-interval", type=float, default=720, help="Minutes between courses runs with `--daemon`")
+    parser.add_argument("--sections-interval", type=float, default=30, help="Minutes between sections runs with `--daemon`")
+    parser.add_argument("--instructors-interval", type=float, default=1440, help="Minutes between instructors runs with `--daemon`")
+    parser.add_argument("--jitter", type=float, default=60, help="Maximum random delay in seconds added to each scheduled run with `--daemon`")
+    parser.add_argument("--metrics-file", help="At the end of each run, write request, parse and upload metrics to this file ('-' for stdout)")
+    parser.add_argument("--metrics-format", choices=["json", "prometheus"], default="json", help="Format of `--metrics-file`: JSON lines (appended) or Prometheus text (overwritten)")
+    parser.add_argument("--course-codes-snapshot", default=".cache/course_codes.json", help="File caching the course codes downloaded from the DB for `--sections` without `--courses`")
+    parser.add_argument("--snapshot-max-age", type=float, default=60, help="Minutes before the course codes snapshot is downloaded again even if the course count is unchanged; with `--daemon`, also how long sections runs reuse the course codes of an earlier run")
+    parser.add_argument("--shard", metavar="I/N", help="Only scrape shard I (0-based) of N: a cost-balanced part of the departments (with `--courses`) or course codes (otherwise), writing rows to `--shard-dir` instead of the DB")
+    parser.add_argument("--merge", action="store_true", help="Combine the rows written by all shards to `--shard-dir` and upload them, instead of scraping")
+    parser.add_argument("--shard-dir", default="shards", help="Directory of the rows written by each shard")
+    parser.add_argument("--shard-costs", default=".cache/shard_costs.json", help="File of department and course costs used to balance shards, updated by `--merge`; must be the same for all shards")
+    parser.add_argument("--checkpoint-dir", help="Record each department's and chunk's results in this directory as they complete, until the run succeeds (threaded engine only)")
+    parser.add_argument("--resume", action="store_true", help="Reuse the results in `--checkpoint-dir` left by a failed run instead of fetching them again")
+    parser.add_argument("--resume-max-age", type=float, default=60, help="Minutes after which results in `--checkpoint-dir` are fetched again even with `--resume`")
+    parser.add_argument("--pipeline", action="store_true", help="With `--sections`, scrape sections of each department's courses as soon as they are parsed, on the same workers as the department pages, instead of after all courses; without `--courses`, course codes come from Testudo rather than the DB")
+    parser.add_argument("--output-format", choices=output.OUTPUT_FORMATS, default="table", help="Format of `--print-output`: a table for reading, or JSON lines or CSV written to `--output-dir` as rows are scraped")
+    parser.add_argument("--output-dir", help="With `--print-output`, write each table to `<table>.<format>` in this directory; required for JSON lines and CSV")
+    parser.add_argument("--snapshot-dir", help="Also write every table to a compressed snapshot in this directory: Parquet if `pyarrow` is installed, otherwise gzipped JSON lines. The previous snapshots are only replaced once the whole run succeeds")
+    parser.add_argument("--parser", choices=PARSERS, default="html.parser", help="HTML parser backend for Testudo pages; `lxml` is considerably faster")
+    args = parser.parse_args()
+    if not args.term:
+        if args.courses or args.sections:
+            parser.error("--term is required with --courses or --sections")
+        # Instructors don't depend on the term
+        args.term = [None]
+    if args.shard and (args.daemon or args.targeted or args.merge):
+        parser.error("--shard can't be combined with --daemon, --targeted or --merge")
+    if args.pipeline and (args.stream or args.targeted or args.adaptive_chunks or args.engine == "async"):
+        parser.error("--pipeline can't be combined with --stream, --targeted, --adaptive-chunks or --engine async")
+    if args.stream and not (args.staging or args.print_output or args.shard):
+        # Otherwise the live tables would be emptied before the first row is scraped
+        parser.error("--stream requires --staging unless rows aren't uploaded (--print-output or --shard)")
+    if args.output_format != "table" and not args.output_dir:
+        parser.error(f"--output-format {args.output_format} requires --output-dir")
+    if args.resume and not args.checkpoint_dir:
+        parser.error("--resume requires --checkpoint-dir")
+    if args.shard:
+        try:
+            Shard.parse(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+    return args
 
 def main():
     args = parse_args()
+    set_parser(args.parser)
+    fetch.set_timeout(fetch.DEFAULT_TIMEOUT[0], args.timeout)
+    fetch.set_fixtures(record_dir=args.record, replay_dir=args.replay)
+    output.set_output_format(args.output_format, args.output_dir)
+    output.set_snapshot_dir(args.snapshot_dir)
+    cache = ResponseCache(args.cache_dir, max_bytes=args.cache_max_mb * 1_000_000) if args.cache_dir else None
+
+    if args.merge:
+        try:
+            merge_shards(args)
+        except BaseException:
+            output.discard_snapshot()
+            raise
+        output.commit_snapshot()
+        return
+
+    if args.daemon:
+        from daemon import run_daemon
+        run_daemon(args, cache, run_once)
+        return
+
+    run_once(args, cache)
+
+def run_once(args, cache, known_course_codes=None):
+    '''
+    Runs everything enabled in `args` once. Returns a dict of the course codes
+    that were scraped or used for sections in each term.
+    '''
+    try:
+        course_codes = run_jobs(args, cache, known_course_codes)
+    except BaseException:
+        # Keep the previous snapshot of every table
+        output.discard_snapshot()
+        raise
+    else:
+        output.commit_snapshot()
+    finally:
+        if args.metrics_file:
+            metrics.write(args.metrics_file, args.metrics_format)
+        metrics.reset()
+    return course_codes
+
+def run_jobs(args, cache, known_course_codes):
+    shard = Shard.parse(args.shard, costs_path=args.shard_costs) if args.shard else None
+    writer = ShardWriter(args.shard_dir, shard, args.term) if shard else None
+    checkpoint = None
+    if args.checkpoint_dir:
+        checkpoint = Checkpoint(args.checkpoint_dir, max_age=args.resume_max_age * 60 if args.resume else None)
+    if args.pipeline and args.sections:
+        course_codes = main_pipelined(args, cache, shard, writer, checkpoint)
+    elif args.stream:
+        course_codes = main_streaming(args, cache, known_course_codes, shard, writer, checkpoint)
+    else:
+        course_codes = main_collected(args, cache, known_course_codes, shard, writer, checkpoint)
+
+    # Get instructors from PlanetTerp API and upload to DB; when sharded, only
+    # the first shard gets them. PlanetTerp doesn't distinguish terms, so
+    # they're fetched once and only uploaded to `instructors`.
+    if args.instructors and writer is not None:
+        if shard.index == 0:
+            writer.upload(get_instructors(args.term[0]), table='instructors')
+    elif args.instructors:
+        instructors_data = get_instructors(args.term[0])
+        if args.incremental:
+            sync_instructors(instructors_data, args.print_output, batch_size=args.batch_size,
+                             workers=args.upload_workers)
+        else:
+            upload_data(instructors_data, args.print_output, table='instructors', batch_size=args.batch_size,
+                        workers=args.upload_workers, staging=args.staging)
+
+    if writer is not None:
+        writer.finish()
+    if checkpoint is not None:
+        # Nothing left to resume
+        checkpoint.clear()
+    return course_codes
+
+def merge_shards(args):
+    '''
+    Uploads the rows written by all shards in `--shard-dir` as if they had
+    been scraped by a single run, and records their costs for future shards.
+    '''
+    tables = read_shards(args.shard_dir, args.term)
+    save_costs(args.shard_costs, tables)
+    # Courses before sections before instructors, as in a single run
+    order = ('courses', 'sections', 'instructors')
+    def upload_order(table):
+        return (next(i for (i, prefix) in enumerate(order) if table.startswith(prefix)), table)
+    for table in sorted(tables, key=upload_order):
+        rows = tables[table]
+        if args.incremental and table.startswith('sections'):
+            sync_sections(rows, args.print_output, batch_size=args.batch_size, workers=args.upload_workers, table=table)
+        elif args.incremental and table.startswith('instructors'):
+            sync_instructors(rows, args.print_output, batch_size=args.batch_size, workers=args.upload_workers,
+                             table=table)
+        else:
+            upload_data(rows, args.print_output, table=table, batch_size=args.batch_size, workers=args.upload_workers,
+                        staging=args.staging)
+
+def main_collected(args, cache, known_course_codes=None, shard=None, writer=None, checkpoint=None):
+    '''
+    `known_course_codes`: if given, a dict of each term's course codes used
+    for section scraping instead of downloading them from the DB when
+    `--courses` isn't enabled
+
+    `shard`, `writer`: with `--shard`, the `Shard` to scrape and the
+    `ShardWriter` its rows are written to instead of the DB
+
+    `checkpoint`: optional `Checkpoint` of the results of each department and
+    chunk
+
+    Returns a dict of the course codes that were scraped or used for sections
+    in each term.
+    '''
+    terms = args.term
+    upload = partial(upload_data, print_output=args.print_output, batch_size=args.batch_size,
+                     workers=args.upload_workers, staging=args.staging)
+    if writer is not None:
+        upload = writer.upload
+    select_depts = shard.select_depts if shard else None
 
     # Get courses; if section scraping is enabled but courses isn't, get
     # list of courses from DB.
     if args.courses:
-        course_data = scrape_courses(args.term, args.department)
-    elif args.sections:
-        course_data = download_course_codes(args.department)
+        if args.engine == "async":
+            from async_engine import scrape_courses_async
+            course_data = {term: scrape_courses_async(term, args.department, concurrency=args.concurrency,
+                                                      select_depts=select_depts)
+                           for term in terms}
+        else:
+            course_data = scrape_courses_for_terms(terms, args.department, parse_processes=args.parse_processes, cache=cache,
+                                                   select_depts=select_depts, checkpoint=checkpoint)
+        all_course_codes = {term: [course.course_code for course in course_data[term]] for term in terms}
     else:
-        course_data = []
-    course_codes = [course["course_code"] for course in course_data]
+        all_course_codes = get_course_codes(args, known_course_codes, shard)
+    due = {term: select_due_courses(args, term, all_course_codes[term]) for term in terms}
+    course_codes = {term: codes for (term, (codes, _)) in due.items()}
     
     # Scrape sections from Testudo
     if args.sections:
-        sections_data = scrape_sections(args.term, course_codes)
+        if args.engine == "async":
+            from async_engine import scrape_sections_async
+            sections_data = {term: scrape_sections_async(term, course_codes[term], concurrency=args.concurrency,
+                                                         chunk_size=args.chunk_size)
+                             for term in terms}
+        else:
+            sections_data = scrape_sections_for_terms(course_codes, parse_processes=args.parse_processes,
+                                                      chunk_size=args.chunk_size, adaptive=args.adaptive_chunks, cache=cache,
+                                                      checkpoint=checkpoint)
 
     # Upload courses and sections to DB
+    for term in terms:
+        if args.courses:
+            upload(course_data[term], table=term_table('courses', term, terms[0]))
+        if args.sections:
+            upload_sections(args, term, sections_data[term], course_codes[term], due[term][1], upload)
+    return all_course_codes
+
+def main_streaming(args, cache, known_course_codes=None, shard=None, writer=None, checkpoint=None):
+    '''
+    Like `main_collected`, but each table is uploaded while it is scraped, so
+    that memory use doesn't grow with the size of the catalog. Courses are
+    uploaded before sections are scraped.
+    '''
+    terms = args.term
+    upload = partial(upload_stream, print_output=args.print_output, batch_size=args.batch_size,
+                     workers=args.upload_workers, staging=args.staging)
+    if writer is not None:
+        upload = writer.upload
+
     if args.courses:
-        upload_data(course_data, args.print_output, table='courses')
+        all_course_codes = {term: [] for term in terms}
+        def upload_courses(term, course_lists):
+            def collect_codes():
+                for courses in course_lists:
+                    for course in courses:
+                        all_course_codes[term].append(course.course_code)
+                        yield course
+            upload(collect_codes(), table=term_table('courses', term, terms[0]))
+        courses = iter_courses_for_terms(terms, args.department, parse_processes=args.parse_processes, cache=cache,
+                                         select_depts=shard.select_depts if shard else None, checkpoint=checkpoint)
+        demultiplex(courses, terms, upload_courses)
+    else:
+        all_course_codes = get_course_codes(args, known_course_codes, shard)
+
+    due = {term: select_due_courses(args, term, all_course_codes[term]) for term in terms}
+    course_codes = {term: codes for (term, (codes, _)) in due.items()}
+
     if args.sections:
-        upload_data(sections_data, args.print_output, table='sections')
+        def upload_term_sections(term, section_lists):
+            sections = (section for sections in section_lists for section in sections)
+            upload_sections(args, term, sections, course_codes[term], due[term][1], upload)
+        sections = iter_sections_for_terms(course_codes, parse_processes=args.parse_processes,
+                                           chunk_size=args.chunk_size, adaptive=args.adaptive_chunks, cache=cache,
+                                           checkpoint=checkpoint)
+        demultiplex(sections, terms, upload_term_sections)
+    return all_course_codes
+
+def main_pipelined(args, cache, shard=None, writer=None, checkpoint=None):
+    '''
+    Like `main_collected`, but sections are scraped while courses still are;
+    see `scrape_courses_and_sections`. Courses are only uploaded with
+    `--courses`.
+    '''
+    terms = args.term
+    upload = partial(upload_data, print_output=args.print_output, batch_size=args.batch_size,
+                     workers=args.upload_workers, staging=args.staging)
+    if writer is not None:
+        upload = writer.upload
 
-    # Get instructors from PlanetTerp API and upload to DB
-    if args.instructors:
-        instructors_data = get_instructors(args.term)
-        upload_data(instructors_data, args.print_output, table='instructors')
+    (course_data, sections_data) = scrape_courses_and_sections(
+        terms, args.department, parse_processes=args.parse_processes, chunk_size=args.chunk_size, cache=cache,
+        checkpoint=checkpoint, select_depts=shard.select_depts if shard else None)
+    all_course_codes = {term: [course.course_code for course in course_data[term]] for term in terms}
+
+    for term in terms:
+        if args.courses:
+            upload(course_data[term], table=term_table('courses', term, terms[0]))
+        upload_sections(args, term, sections_data[term], all_course_codes[term], None, upload)
+    return all_course_codes
+
+def get_course_codes(args, known_course_codes=None, shard=None):
+    '''
+    Course codes to scrape sections for when `--courses` isn't enabled, as a
+    dict of each term's course codes, narrowed down to `shard` if given.
+    '''
+    if not args.sections:
+        return {term: [] for term in args.term}
+    if known_course_codes is not None:
+        return {term: list(known_course_codes[term]) for term in args.term}
+    if shard is not None:
+        return {term: shard.select_courses(codes) for (term, codes) in get_course_codes(args).items()}
+    return {
+        term: [course["course_code"] for course in download_course_codes(
+            args.department, snapshot_path=args.course_codes_snapshot, max_snapshot_age=args.snapshot_max_age * 60,
+            table=term_table('courses', term, args.term[0]))]
+        for term in args.term
+    }
+
+def select_due_courses(args, term, course_codes):
+    '''
+    With `--targeted`, narrows `course_codes` down to the courses of `term`
+    whose sections are due for a refresh. Returns the course codes and the
+    loaded `RefreshHistory`, or None if not targeted.
+    '''
+    if not (args.sections and args.targeted):
+        return (course_codes, None)
+    history = RefreshHistory.load(history_path(args, term))
+    due = history.due_courses(course_codes, hot_interval=args.hot_interval * 60, cold_interval=args.cold_interval * 60)
+    print(f"Refreshing sections for {len(due)} of {len(course_codes)} courses in {term}.")
+    return (due, history)
+
+def history_path(args, term):
+    # Each term other than the first keeps its own history next to `--history`
+    if term == args.term[0]:
+        return args.history
+    (root, ext) = os.path.splitext(args.history)
+    return f"{root}_{term}{ext}"
+
+def upload_sections(args, term, sections, course_codes, history, upload):
+    '''
+    Uploads `sections` of `term`, which may be an iterator, according to the
+    sync mode.
+    '''
+    table = term_table('sections', term, args.term[0])
+    if args.shard:
+        upload(sections, table=table)
+    elif history is not None:
+        sections = list(sections)
+        sync_sections(sections, args.print_output, batch_size=args.batch_size, workers=args.upload_workers,
+                      course_codes=course_codes, table=table)
+        if not args.print_output:
+            history.record(course_codes, sections)
+            history.save()
+    elif args.incremental:
+        # Deletions can only be determined once every section is known
+        sync_sections(list(sections), args.print_output, batch_size=args.batch_size, workers=args.upload_workers,
+                      table=table)
+    else:
+        upload(sections, table=table)
 
 if __name__ == "__main__":
     main()
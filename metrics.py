@@ -0,0 +1,127 @@
+import json
+import threading
+import time
+
+# Upper bounds in seconds of the buckets of every latency histogram
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for (i, bound) in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+
+class Metrics:
+    '''
+    Thread-safe registry of counters, histograms and per-unit timings (e.g.
+    parse time of each department) for one run, written out at the end of the
+    run as JSON lines or in the Prometheus text format. Metrics are identified
+    by a name and optional labels.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = dict()
+            self.histograms = dict()
+            self.timings = []
+
+    def increment(self, name: str, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def record_timing(self, name: str, unit: str, seconds: float, **labels):
+        '''
+        Records how long `unit` (e.g. a department) took, both individually
+        and in the `name` histogram.
+        '''
+        self.observe(name, seconds, **labels)
+        with self.lock:
+            self.timings.append({"metric": name, "unit": unit, "seconds": seconds, **labels})
+
+    def time(self, name: str, unit: str, **labels):
+        '''
+        Context manager recording the duration of its block with `record_timing`.
+        '''
+        return _Timer(self, name, unit, labels)
+
+    def json_lines(self) -> str:
+        timestamp = time.time()
+        lines = []
+        with self.lock:
+            for ((name, labels), value) in sorted(self.counters.items()):
+                lines.append({"type": "counter", "metric": name, "labels": dict(labels), "value": value})
+            for ((name, labels), h) in sorted(self.histograms.items(), key=lambda item: item[0]):
+                lines.append({"type": "histogram", "metric": name, "labels": dict(labels), "count": h.count,
+                              "sum": h.sum, "buckets": dict(zip([*map(str, BUCKETS), "+Inf"], h.counts))})
+            for timing in self.timings:
+                lines.append({"type": "timing", **timing})
+        return "".join(json.dumps({"timestamp": timestamp, **line}) + "\n" for line in lines)
+
+    def prometheus_text(self) -> str:
+        out = []
+        with self.lock:
+            for ((name, labels), value) in sorted(self.counters.items()):
+                out.append(f"scraper_{name}{_format_labels(labels)} {value}")
+            for ((name, labels), h) in sorted(self.histograms.items(), key=lambda item: item[0]):
+                cumulative = 0
+                for (bound, count) in zip([*map(str, BUCKETS), "+Inf"], h.counts):
+                    cumulative += count
+                    out.append(f"scraper_{name}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+                out.append(f"scraper_{name}_sum{_format_labels(labels)} {h.sum}")
+                out.append(f"scraper_{name}_count{_format_labels(labels)} {h.count}")
+        return "\n".join(out) + "\n"
+
+    def write(self, path: str, fmt: str):
+        '''
+        Writes all metrics to `path` ('-' for stdout) in `fmt`, either 'json'
+        (appended, so runs accumulate) or 'prometheus' (overwritten, for a
+        textfile collector).
+        '''
+        text = self.json_lines() if fmt == "json" else self.prometheus_text()
+        if path == "-":
+            print(text, end='')
+            return
+        with open(path, "a" if fmt == "json" else "w") as f:
+            f.write(text)
+
+class _Timer:
+    def __init__(self, metrics: Metrics, name: str, unit: str, labels: dict):
+        self.metrics = metrics
+        self.name = name
+        self.unit = unit
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record_timing(self.name, self.unit, time.perf_counter() - self.start, **self.labels)
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for (k, v) in labels) + "}"
+
+metrics = Metrics()
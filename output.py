@@ -0,0 +1,247 @@
+import csv
+import gzip
+import importlib.util
+import json
+import os
+import threading
+
+# Where rows go besides the DB: printed with `--print-output` in one of
+# `OUTPUT_FORMATS`, and written to a compressed snapshot of each table with
+# `--snapshot-dir`. Rows are written as they arrive rather than collected, so
+# a whole term can be dumped with little memory.
+
+OUTPUT_FORMATS = ["table", "jsonl", "csv"]
+
+_output_format = "table"
+_output_dir = None
+_snapshot = None
+
+def set_output_format(output_format: str, output_dir=None):
+    '''
+    Selects how `print_rows` writes rows: as a table to stdout, or as JSON
+    lines or CSV to `<output_dir>/<table>.<format>`. Stdout also carries
+    progress and status lines and would mix several tables (and CSV headers),
+    so machine-readable formats require `output_dir`.
+    '''
+    global _output_format, _output_dir
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format '{output_format}'; expected one of {OUTPUT_FORMATS}")
+    if output_format != "table" and output_dir is None:
+        raise ValueError(f"Output format '{output_format}' requires an output directory")
+    _output_format = output_format
+    _output_dir = output_dir
+
+def print_rows(rows, table: str) -> int:
+    '''
+    Writes `rows`, which may be an iterator, in the selected format. Returns
+    the number of rows.
+    '''
+    if _output_format == "table":
+        data = list(rows)
+        print_as_table(data)
+        return len(data)
+
+    os.makedirs(_output_dir, exist_ok=True)
+    path = os.path.join(_output_dir, f"{table}.{_output_format}")
+    with open(path, "w", newline="") as f:
+        count = write_rows(rows, f, _output_format)
+    print(f"Wrote {count} rows of {table} to {path}.")
+    return count
+
+def write_rows(rows, f, output_format: str) -> int:
+    count = 0
+    if output_format == "jsonl":
+        for row in rows:
+            f.write(json.dumps(row, separators=(',', ':')))
+            f.write("\n")
+            count += 1
+        return count
+
+    writer = None
+    for row in rows:
+        if writer is None:
+            writer = csv.DictWriter(f, fieldnames=list(row.keys()))
+            writer.writeheader()
+        # Lists and nested values as JSON
+        writer.writerow({
+            key: json.dumps(value) if isinstance(value, (list, dict)) else value
+            for (key, value) in row.items()
+        })
+        count += 1
+    return count
+
+def print_as_table(data, wrap_width=36):
+    from tabulate import tabulate
+    import textwrap
+
+    if not data:
+        print("No data found.")
+        return
+
+    # Wrap long values in each row
+    wrapped_data = []
+    for item in data:
+        wrapped_item = {
+            key: textwrap.fill(str(value), width=wrap_width)
+            for key, value in item.items()
+        }
+        wrapped_data.append(wrapped_item)
+
+    headers = wrapped_data[0].keys()
+    rows = [item.values() for item in wrapped_data]
+    print(tabulate(rows, headers=headers, tablefmt="grid"))
+
+def set_snapshot_dir(directory):
+    '''
+    Starts recording every table passed to `snapshot_rows` in `directory`,
+    or stops if None.
+    '''
+    global _snapshot
+    _snapshot = Snapshot(directory) if directory else None
+
+def commit_snapshot():
+    '''
+    Replaces the previous snapshot of each table recorded since the last
+    commit; called once a run has succeeded.
+    '''
+    if _snapshot is not None:
+        _snapshot.commit()
+
+def discard_snapshot():
+    '''
+    Drops the tables recorded since the last commit, keeping their previous
+    snapshots; called when a run fails.
+    '''
+    if _snapshot is not None:
+        _snapshot.discard()
+
+def snapshot_rows(table: str, rows):
+    '''
+    Returns `rows` (possibly an iterator), recording them in the snapshot as
+    they are consumed if one was started.
+    '''
+    if _snapshot is None:
+        return rows
+    return _snapshot.record(table, rows)
+
+class Snapshot:
+    '''
+    One file per table in `directory`: Parquet (zstd-compressed, one row group
+    per `ROWS_PER_GROUP` rows) if `pyarrow` is installed, otherwise gzipped
+    JSON lines. Each file is written under a temporary name, and only
+    replaces the previous snapshot of its table on `commit`, once the whole
+    run has succeeded; a table whose rows weren't all consumed is dropped
+    right away.
+    '''
+    ROWS_PER_GROUP = 2000
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.format = "parquet" if importlib.util.find_spec("pyarrow") else "jsonl.gz"
+        # `(tmp_path, path)` of each complete table waiting for `commit`
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def commit(self):
+        with self.lock:
+            (pending, self.pending) = (self.pending, [])
+        for (tmp_path, path) in pending:
+            os.replace(tmp_path, path)
+
+    def discard(self):
+        with self.lock:
+            (pending, self.pending) = (self.pending, [])
+        for (tmp_path, _) in pending:
+            os.remove(tmp_path)
+
+    def record(self, table: str, rows):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{table}.{self.format}")
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        writer = ParquetTableWriter(tmp_path, table) if self.format == "parquet" else JsonTableWriter(tmp_path)
+        complete = False
+        try:
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) == self.ROWS_PER_GROUP:
+                    writer.write(batch)
+                    batch = []
+                yield row
+            if batch:
+                writer.write(batch)
+            complete = True
+        finally:
+            writer.close()
+            if complete:
+                with self.lock:
+                    self.pending.append((tmp_path, path))
+            else:
+                # The table wasn't fully scraped; keep the previous snapshot
+                os.remove(tmp_path)
+
+class JsonTableWriter:
+    def __init__(self, path: str):
+        self.file = gzip.open(path, "wt")
+
+    def write(self, rows):
+        write_rows(rows, self.file, "jsonl")
+
+    def close(self):
+        self.file.close()
+
+class ParquetTableWriter:
+    def __init__(self, path: str, table: str):
+        self.path = path
+        self.schema = table_schema(table)
+        self.writer = None
+
+    def write(self, rows):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if self.schema is None:
+            # Columns that are all null in the first rows are assumed to be strings
+            inferred = pa.Table.from_pylist(rows).schema
+            self.schema = pa.schema([
+                field.with_type(pa.string()) if pa.types.is_null(field.type) else field for field in inferred
+            ])
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, self.schema, compression="zstd")
+        self.writer.write_table(pa.Table.from_pylist(rows, schema=self.schema))
+
+    def close(self):
+        if self.writer is None:
+            # No rows; still write an empty file so that the table is present
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            pq.write_table(pa.table({}) if self.schema is None else self.schema.empty_table(), self.path)
+        else:
+            self.writer.close()
+
+def table_schema(table: str):
+    '''
+    Arrow schema of the rows of `table` from `records`, or None for tables
+    whose schema is inferred from their first rows (e.g. instructors).
+    '''
+    import pyarrow as pa
+
+    strings = pa.list_(pa.string())
+    if table.startswith("courses"):
+        return pa.schema([
+            ("course_code", pa.string()), ("name", pa.string()), ("min_credits", pa.int64()),
+            ("max_credits", pa.int64()), ("gen_eds", strings), ("conditions", strings),
+            ("description", pa.string()),
+        ])
+    if table.startswith("sections"):
+        meeting = pa.struct([
+            ("kind", pa.string()), ("days", pa.int64()), ("start", pa.int64()), ("end", pa.int64()),
+            ("building", pa.string()), ("room", pa.string()),
+        ])
+        return pa.schema([
+            ("course_code", pa.string()), ("sec_code", pa.string()), ("instructors", strings),
+            ("meetings", strings), ("open_seats", pa.int64()), ("total_seats", pa.int64()),
+            ("waitlist", pa.int64()), ("holdfile", pa.string()), ("meeting_details", pa.list_(meeting)),
+            ("time_slots", pa.string()),
+        ])
+    return None
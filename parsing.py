@@ -0,0 +1,63 @@
+from __future__ import annotations
+from contextlib import nullcontext
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
+
+# Parser backends understood by BeautifulSoup. `html.parser` ships with Python
+# but is the slowest; `lxml` is much faster but requires the `lxml` package.
+PARSERS = ["html.parser", "lxml"]
+
+_parser = "html.parser"
+
+def set_parser(parser: str):
+    '''
+    Selects the backend used by `make_soup` for all subsequent pages.
+    '''
+    global _parser
+    if parser not in PARSERS:
+        raise ValueError(f"Unknown parser '{parser}'; expected one of {PARSERS}")
+    _parser = parser
+
+def get_parser() -> str:
+    return _parser
+
+def make_soup(text: str) -> BeautifulSoup:
+    # Imported here so that only runs that parse pages pay for it
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(text, features=_parser)
+
+def make_parse_pool(processes: int):
+    '''
+    Process pool for parsing pages outside of the GIL, or a context yielding
+    None if `processes` is 0. Workers are spawned rather than forked since the
+    parent has threads running, and inherit the selected parser.
+    '''
+    if processes == 0:
+        return nullcontext(None)
+    # `multiprocessing` is slow to import and most runs don't use a pool
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+    return ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=set_parser,
+        initargs=(_parser,),
+    )
+
+def index_by_id(doc: BeautifulSoup, ids, name='div'):
+    '''
+    Maps each id in `ids` to its `name` tag in `doc` (any tag if `name` is
+    None) using a single traversal of the tree, rather than one `find` per id.
+    '''
+    ids = set(ids)
+    tags = dict()
+    # Passing `ids` to `find_all` would match every tag against every id
+    # (bs4 makes one rule per value), so only ask for tags with an id and
+    # look them up in the set
+    for tag in doc.find_all(name, id=True):
+        if tag['id'] in ids:
+            # `find` would return the first match, so keep the first one here too
+            tags.setdefault(tag['id'], tag)
+    return tags
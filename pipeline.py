@@ -0,0 +1,151 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from metrics import metrics
+import queue
+import time
+
+def bounded_map(executor, fn, items, max_pending: int):
+    '''
+    Like `executor.map`, but only submits `max_pending` calls ahead of the
+    results consumed so far, so that finished results don't pile up in memory
+    when the consumer is slower than the workers. Yields results in order.
+    '''
+    items = iter(items)
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+class UnitsFailedError(Exception):
+    '''
+    Raised when some units of work (e.g. department pages) still fail after
+    being retried. `failures` lists `(unit, error)` pairs.
+    '''
+    def __init__(self, failures):
+        self.failures = failures
+        names = ", ".join(f"{unit} ({error!r})" for (unit, error) in failures[:5])
+        more = f" and {len(failures) - 5} more" if len(failures) > 5 else ""
+        super().__init__(f"{len(failures)} units failed: {names}{more}")
+
+def map_isolating_failures(executor, fn, items, max_pending: int, retries=2, retry_delay=5.0, describe=str):
+    '''
+    Like `bounded_map`, but an item whose call raises doesn't stop the other
+    items: it is set aside and retried up to `retries` times once all other
+    items are done, so their results are yielded last. Raises
+    `UnitsFailedError` after yielding everything else if some items still
+    fail. `describe` names an item in messages.
+    '''
+    failures = []
+    def call(item):
+        try:
+            return (True, fn(item))
+        except Exception as e:
+            print(f"Failed {describe(item)}: {e!r}; retrying at the end of the run.")
+            metrics.increment("failed_units_total")
+            return (False, (item, e))
+
+    for (succeeded, value) in bounded_map(executor, call, items, max_pending):
+        if succeeded:
+            yield value
+        else:
+            failures.append(value)
+    yield from retry_failures(fn, failures, retries=retries, retry_delay=retry_delay, describe=describe)
+
+def retry_failures(fn, failures, retries=2, retry_delay=5.0, describe=str):
+    '''
+    Retries `fn` on each item of the `(item, error)` pairs in `failures` up to
+    `retries` times, yielding the results, then raises `UnitsFailedError` if
+    some items still fail.
+    '''
+    still_failing = []
+    for (item, error) in failures:
+        for attempt in range(retries):
+            # Give a transient error time to clear up
+            time.sleep(retry_delay)
+            try:
+                result = fn(item)
+                break
+            except Exception as e:
+                error = e
+        else:
+            still_failing.append((describe(item), error))
+            continue
+        yield result
+    if still_failing:
+        raise UnitsFailedError(still_failing)
+
+def fair_share(items_by_key: dict):
+    '''
+    Interleaves the items of each key round-robin, yielding `(key, item)`
+    pairs, so that a shared pool of workers advances every key at the same
+    rate. Keys with more items continue alone once the others run out.
+    '''
+    iterators = {key: iter(items) for (key, items) in items_by_key.items()}
+    while iterators:
+        for key in list(iterators):
+            try:
+                item = next(iterators[key])
+            except StopIteration:
+                del iterators[key]
+                continue
+            yield (key, item)
+
+def demultiplex(pairs, keys, consume, max_pending=2):
+    '''
+    Routes `(key, item)` pairs to one consumer per key, calling
+    `consume(key, items)` in its own thread with an iterator over that key's
+    items, of which at most `max_pending` are queued. Returns a dict of each
+    consumer's result. If producing `pairs` raises, the consumers' iterators
+    raise the same exception. With a single key, `consume` runs in the calling
+    thread.
+    '''
+    keys = list(keys)
+    if len(keys) == 1:
+        return {keys[0]: consume(keys[0], (item for (_, item) in pairs))}
+
+    queues = {key: queue.Queue(maxsize=max_pending) for key in keys}
+
+    def items(key):
+        while True:
+            (finished, item) = queues[key].get()
+            if not finished:
+                yield item
+            elif item is not None:
+                raise item
+            else:
+                return
+
+    with ThreadPoolExecutor(max_workers=len(keys)) as executor:
+        futures = {key: executor.submit(consume, key, items(key)) for key in keys}
+
+        def put(key, entry):
+            # Gives up if the consumer already stopped, rather than blocking forever
+            while not futures[key].done():
+                try:
+                    queues[key].put(entry, timeout=0.5)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        error = None
+        try:
+            for (key, item) in pairs:
+                if not put(key, (False, item)):
+                    futures[key].result()
+                    raise RuntimeError(f"Consumer for {key} stopped before all of its items were produced")
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            for key in keys:
+                put(key, (True, error))
+        return {key: future.result() for (key, future) in futures.items()}
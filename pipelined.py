@@ -0,0 +1,136 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import time
+import fetch
+from courses import get_course_progress, dept_url, get_depts, get_courses_for_dept
+from metrics import metrics
+from parsing import make_parse_pool
+from pipeline import UnitsFailedError, fair_share
+from sections import CHUNK_SIZE, get_sections_progress, chunk_end, chunk_url, get_sections_for_chunk
+
+# Scrapes courses and sections in a single phase: as soon as a department's
+# courses are parsed, their codes are queued for sections requests, which
+# share the same workers as the remaining department requests. Total time is
+# then close to the longer of the two phases rather than their sum.
+
+class ChunkBuffer:
+    '''
+    Collects course codes of one term as departments complete, handing out
+    full chunks of sections requests as soon as there are enough courses.
+    '''
+    def __init__(self, term: str, chunk_size: int):
+        self.term = term
+        self.chunk_size = chunk_size
+        self.course_codes = []
+
+    def add(self, course_codes):
+        self.course_codes += course_codes
+
+    def take_chunks(self, final=False):
+        '''
+        Removes and returns all full chunks, and with `final` the remaining
+        courses as well.
+        '''
+        chunks = []
+        while self.course_codes:
+            end = chunk_end(self.course_codes, 0, self.chunk_size, self.term)
+            # Wait for more courses unless the chunk is full by size or URL length
+            if not final and end == len(self.course_codes) and end < self.chunk_size:
+                break
+            chunks.append(self.course_codes[:end])
+            self.course_codes = self.course_codes[end:]
+        return chunks
+
+def scrape_courses_and_sections(terms: list[str], dept: str, parse_processes=0, chunk_size=CHUNK_SIZE, cache=None,
+                                checkpoint=None, select_depts=None, workers=5, retries=2, retry_delay=5.0):
+    '''
+    Scrapes the courses and sections of each term in `terms` with `workers`
+    shared between department and sections requests, preferring sections
+    requests so that courses don't pile up. Returns dicts of each term's
+    courses and of each term's sections.
+
+    Like the separate phases, a failing department or chunk is retried at the
+    end and `UnitsFailedError` is raised if it still fails.
+    '''
+    depts = [dept] if dept else get_depts()
+    if select_depts is not None:
+        depts = select_depts(depts)
+    courses = {term: [] for term in terms}
+    sections = {term: [] for term in terms}
+    buffers = {term: ChunkBuffer(term, chunk_size) for term in terms}
+
+    get_course_progress().reset()
+    get_course_progress().multi_term = len(terms) > 1
+    get_course_progress().total_depts = len(depts) * len(terms)
+    get_sections_progress().reset()
+    get_sections_progress().multi_term = len(terms) > 1
+    fetch.get_session(pool_size=workers)
+    # The displays can't share the terminal, so sections progress is only
+    # shown once all departments are done
+    get_course_progress().start_logging(num_workers=workers, request_stats=fetch.request_stats)
+
+    pending_depts = deque(("dept", item, 0) for item in fair_share({term: depts for term in terms}))
+    pending_chunks = deque()
+    deferred = []
+    failures = []
+    try:
+        with make_parse_pool(parse_processes) as parse_pool, ThreadPoolExecutor(max_workers=workers) as executor:
+            def run(unit):
+                (kind, (term, item), _) = unit
+                if kind == "dept":
+                    return get_courses_for_dept(item, term, parse_pool=parse_pool, cache=cache, checkpoint=checkpoint)
+                return get_sections_for_chunk(item, term, parse_pool=parse_pool, cache=cache, checkpoint=checkpoint)
+
+            in_flight = dict()
+            depts_done = False
+            while pending_depts or pending_chunks or in_flight or deferred:
+                if not (pending_depts or pending_chunks or in_flight):
+                    # Only failed units are left; give a transient error time to clear up
+                    time.sleep(retry_delay)
+                    for unit in deferred:
+                        (pending_depts if unit[0] == "dept" else pending_chunks).append(unit)
+                    deferred = []
+                while len(in_flight) < workers and (pending_chunks or pending_depts):
+                    unit = pending_chunks.popleft() if pending_chunks else pending_depts.popleft()
+                    in_flight[executor.submit(run, unit)] = unit
+
+                (done, _) = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    unit = in_flight.pop(future)
+                    (kind, (term, item), attempt) = unit
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        name = dept_url(item, term) if kind == "dept" else chunk_url(item, term)
+                        if attempt < retries:
+                            print(f"Failed {name}: {e!r}; retrying at the end of the run.")
+                            metrics.increment("failed_units_total")
+                            deferred.append((kind, (term, item), attempt + 1))
+                        else:
+                            failures.append((name, e))
+                        continue
+                    if kind == "dept":
+                        courses[term] += result
+                        buffers[term].add([course.course_code for course in result])
+                        with get_sections_progress().lock:
+                            get_sections_progress().courses_sections_to_parse += len(result)
+                    else:
+                        sections[term] += result
+
+                # Flush partial chunks once no more courses can arrive
+                final = not pending_depts and not any(unit[0] == "dept" for unit in in_flight.values()) \
+                    and not any(unit[0] == "dept" for unit in deferred)
+                for (term, buffer) in buffers.items():
+                    pending_chunks.extend(("chunk", (term, chunk), 0) for chunk in buffer.take_chunks(final))
+
+                if final and not depts_done:
+                    depts_done = True
+                    get_course_progress().stop_logging()
+                    get_sections_progress().start_logging(num_workers=workers, request_stats=fetch.request_stats)
+    finally:
+        get_course_progress().stop_logging()
+        get_sections_progress().stop_logging()
+
+    if failures:
+        raise UnitsFailedError(failures)
+    return (courses, sections)
@@ -1,9 +1,28 @@
-import colorama
-from colorama import Fore, Style
 import sys
 import threading
 import time
 
+# Seconds between status lines when stdout isn't a terminal (e.g. CI logs),
+# where the display can't be redrawn in place
+PLAIN_INTERVAL = 15
+
+_colorama_initialized = False
+
+def _init_colorama():
+    # Only needed for the redrawn display, so it's imported on first use;
+    # `init` wraps stdout and must only run once
+    global _colorama_initialized
+    if not _colorama_initialized:
+        import colorama
+        colorama.init()
+        _colorama_initialized = True
+
+def _sleep_while_set(event: threading.Event, seconds: float):
+    # Sleeps for `seconds`, waking up early if `event` is cleared
+    deadline = time.monotonic() + seconds
+    while event.is_set() and time.monotonic() < deadline:
+        time.sleep(max(0.0, min(0.5, deadline - time.monotonic())))
+
 class CourseScrapingProgress:
     '''
     Keeps track and logs the number of courses resolved vs. parsed.
@@ -12,26 +31,41 @@ class CourseScrapingProgress:
         '''
         `interval`: time in second between logs
         '''
-        colorama.init()
+        self.lock = threading.Lock()
+        self.logging_enabled = threading.Event()
+        self.logging_thread = None
+        self.interval = interval
+        self.tty = sys.stdout.isatty()
+        self.reset()
+
+    def reset(self):
+        '''
+        Clears all counters, e.g. before scraping again in the same process.
+        '''
         self.courses_resolved = 0
         self.courses_parsed = 0
         self.total_depts = 0
         self.depts_complete = 0
         self.depts_in_progress = dict()
-        self.lock = threading.Lock()
-        self.logging_enabled = threading.Event()
-        self.logging_thread = None
         self.num_workers = 0
-        self.interval = interval
         self.start_time = None
+        self.request_stats = None
+        # Set when scraping several terms at once, so names include the term
+        self.multi_term = False
+
+    def label(self, name: str, term: str | None = None):
+        '''
+        Name under which a department or chunk starting at `name` is shown.
+        '''
+        return f"{term} {name}" if self.multi_term and term is not None else name
 
     def increment_courses_resolved(self, amount=1):
         with self.lock:
             self.courses_resolved += amount
 
-    def increment_courses_parsed(self):
+    def increment_courses_parsed(self, amount=1):
         with self.lock:
-            self.courses_parsed += 1
+            self.courses_parsed += amount
 
     def mark_dept_sending_req(self, dept: str):
         with self.lock:
@@ -46,9 +80,19 @@ class CourseScrapingProgress:
             self.depts_complete += 1
             self.depts_in_progress.pop(dept)
 
-    def start_logging(self, num_workers: int):
+    def mark_dept_failed(self, dept: str):
+        with self.lock:
+            self.depts_in_progress.pop(dept, None)
+
+    def start_logging(self, num_workers: int, request_stats=None):
+        '''
+        `request_stats`: optional `fetch.RequestStats` to display alongside progress
+        '''
         if not self.logging_enabled.is_set():
+            if self.tty:
+                _init_colorama()
             self.num_workers = num_workers
+            self.request_stats = request_stats
             self.start_time = time.perf_counter()
             self.logging_enabled.set()
             self.logging_thread = threading.Thread(target=self._log_status, daemon=True)
@@ -60,41 +104,65 @@ class CourseScrapingProgress:
             self.logging_thread.join()
 
     def _log_status(self):
+        from colorama import Fore, Style
+
         while self.logging_enabled.is_set():
+            # Copy the state under the lock but print outside of it, so that
+            # workers are never blocked on stdout
             with self.lock:
-                cur_time = time.perf_counter()
-                elapsed_time = cur_time - self.start_time
+                courses_resolved = self.courses_resolved
+                courses_parsed = self.courses_parsed
+                depts_complete = self.depts_complete
+                depts_in_progress = dict(self.depts_in_progress)
+            elapsed_time = time.perf_counter() - self.start_time
+            http_summary = self.request_stats.summary() if self.request_stats else None
 
-                print("\033[2K", end='')  # Clear line
-                print(f"{Fore.WHITE}{Style.BRIGHT}Scraping and parsing all courses...{Style.RESET_ALL}")
-                print("\033[2K", end='')
-                print(f"{Fore.WHITE}{Style.DIM}(Elapsed time: {elapsed_time:.0f} seconds){Style.RESET_ALL}")
+            if not self.tty:
+                line = (f"[{elapsed_time:.0f}s] Courses resolved: {courses_resolved}, parsed: {courses_parsed}, "
+                        f"departments complete: {depts_complete} of {self.total_depts}")
+                if http_summary:
+                    line += f"; HTTP: {http_summary}"
+                print(line, flush=True)
+                _sleep_while_set(self.logging_enabled, max(self.interval, PLAIN_INTERVAL))
+                continue
+
+            print("\033[2K", end='')  # Clear line
+            print(f"{Fore.WHITE}{Style.BRIGHT}Scraping and parsing all courses...{Style.RESET_ALL}")
+            print("\033[2K", end='')
+            print(f"{Fore.WHITE}{Style.DIM}(Elapsed time: {elapsed_time:.0f} seconds){Style.RESET_ALL}")
+            print("\033[2K", end='')
+            print(f"\tCourses resolved: {Fore.GREEN}{Style.BRIGHT}{courses_resolved}{Style.RESET_ALL}")
+            print("\033[2K", end='')
+            print(f"\tCourses parsed: {Fore.GREEN}{Style.BRIGHT}{courses_parsed}{Style.RESET_ALL}")
+            print("\033[2K", end='')
+            print(f"\tCompleted parsing for {Fore.GREEN}{Style.BRIGHT}{depts_complete}{Style.RESET_ALL} of {Fore.GREEN}{Style.BRIGHT}{self.total_depts}{Style.RESET_ALL} departments")
+            num_lines = 5
+            if http_summary:
                 print("\033[2K", end='')
-                print(f"\tCourses resolved: {Fore.GREEN}{Style.BRIGHT}{self.courses_resolved}{Style.RESET_ALL}")
+                print(f"\t{Fore.WHITE}{Style.DIM}HTTP: {http_summary}{Style.RESET_ALL}")
+                num_lines += 1
+            
+            for dept in depts_in_progress:
+                if depts_in_progress[dept] == 0:
+                    progress = f"{Fore.WHITE}{Style.DIM}Request sent, awaiting response"
+                else:
+                    progress = f"{Fore.WHITE}{Style.NORMAL}Parsing response"
                 print("\033[2K", end='')
-                print(f"\tCourses parsed: {Fore.GREEN}{Style.BRIGHT}{self.courses_parsed}{Style.RESET_ALL}")
+                print(f"\t\t{Fore.CYAN}{Style.BRIGHT}{dept}{Style.RESET_ALL}: {progress}{Style.RESET_ALL}")
+                num_lines += 1
+            
+            for _ in range(self.num_workers - len(depts_in_progress)):
                 print("\033[2K", end='')
-                print(f"\tCompleted parsing for {Fore.GREEN}{Style.BRIGHT}{self.depts_complete}{Style.RESET_ALL} of {Fore.GREEN}{Style.BRIGHT}{self.total_depts}{Style.RESET_ALL} departments")
-                
-                for dept in self.depts_in_progress:
-                    if self.depts_in_progress[dept] == 0:
-                        progress = f"{Fore.WHITE}{Style.DIM}Request sent, awaiting response"
-                    else:
-                        progress = f"{Fore.WHITE}{Style.NORMAL}Parsing response"
-                    print("\033[2K", end='')
-                    print(f"\t\t{Fore.CYAN}{Style.BRIGHT}{dept}{Style.RESET_ALL}: {progress}{Style.RESET_ALL}")
-                
-                for _ in range(self.num_workers - len(self.depts_in_progress)):
-                    print("\033[2K", end='')
-                    print(f"\t\t{Fore.YELLOW}{Style.DIM}1 worker idle{Style.RESET_ALL}")
-                
-                num_lines = 5 + self.num_workers
-                sys.stdout.write(f"\033[{num_lines}A")
-                sys.stdout.flush()
+                print(f"\t\t{Fore.YELLOW}{Style.DIM}1 worker idle{Style.RESET_ALL}")
+                num_lines += 1
+            
+            sys.stdout.write(f"\033[{num_lines}A")
+            sys.stdout.flush()
             time.sleep(self.interval)
             
         # Move to next line after logging ends
-        print("\033[2K", end='')
+        if self.tty:
+            print("\033[2K", end='')
         print("Scraping and parsing all courses complete.")
 
 class SectionScrapingProgress:
@@ -105,16 +173,31 @@ class SectionScrapingProgress:
         '''
         `interval`: time in second between logs
         '''
-        colorama.init()
-        self.courses_sections_to_parse = 0
-        self.courses_sections_parsed = 0
-        self.status = dict()
         self.lock = threading.Lock()
         self.logging_enabled = threading.Event()
         self.logging_thread = None
-        self.num_workers = 0
         self.interval = interval
+        self.tty = sys.stdout.isatty()
+        self.reset()
+
+    def reset(self):
+        '''
+        Clears all counters, e.g. before scraping again in the same process.
+        '''
+        self.courses_sections_to_parse = 0
+        self.courses_sections_parsed = 0
+        self.status = dict()
+        self.num_workers = 0
         self.start_time = None
+        self.request_stats = None
+        # Set when scraping several terms at once, so names include the term
+        self.multi_term = False
+
+    def label(self, name: str, term: str | None = None):
+        '''
+        Name under which a department or chunk starting at `name` is shown.
+        '''
+        return f"{term} {name}" if self.multi_term and term is not None else name
     
     def mark_chunk_sending_req(self, chunk_start: str, chunk_end: str):
         with self.lock:
@@ -124,19 +207,29 @@ class SectionScrapingProgress:
         with self.lock:
             self.status[(chunk_start, chunk_end)] = (0, chunk_size)
     
-    def increment_chunk_courses_parsed(self, chunk_start: str, chunk_end: str):
+    def increment_chunk_courses_parsed(self, chunk_start: str, chunk_end: str, amount=1):
         with self.lock:
-            self.courses_sections_parsed += 1
+            self.courses_sections_parsed += amount
             (parsed, chunk_size) = self.status[(chunk_start, chunk_end)]
-            self.status[(chunk_start, chunk_end)] = (parsed + 1, chunk_size)
+            self.status[(chunk_start, chunk_end)] = (parsed + amount, chunk_size)
 
     def mark_chunk_complete(self, chunk_start: str, chunk_end: str):
         with self.lock:
             self.status.pop((chunk_start, chunk_end))
 
-    def start_logging(self, num_workers: int):
+    def mark_chunk_failed(self, chunk_start: str, chunk_end: str):
+        with self.lock:
+            self.status.pop((chunk_start, chunk_end), None)
+
+    def start_logging(self, num_workers: int, request_stats=None):
+        '''
+        `request_stats`: optional `fetch.RequestStats` to display alongside progress
+        '''
         if not self.logging_enabled.is_set():
+            if self.tty:
+                _init_colorama()
             self.num_workers = num_workers
+            self.request_stats = request_stats
             self.start_time = time.perf_counter()
             self.logging_enabled.set()
             self.logging_thread = threading.Thread(target=self._log_status, daemon=True)
@@ -148,38 +241,60 @@ class SectionScrapingProgress:
             self.logging_thread.join()
 
     def _log_status(self):
+        from colorama import Fore, Style
+
         while self.logging_enabled.is_set():
+            # Copy the state under the lock but print outside of it, so that
+            # workers are never blocked on stdout
             with self.lock:
-                cur_time = time.perf_counter()
-                elapsed_time = cur_time - self.start_time
+                courses_sections_parsed = self.courses_sections_parsed
+                status = dict(self.status)
+            elapsed_time = time.perf_counter() - self.start_time
+            http_summary = self.request_stats.summary() if self.request_stats else None
+
+            if not self.tty:
+                line = (f"[{elapsed_time:.0f}s] Courses' sections scraped: {courses_sections_parsed} of "
+                        f"{self.courses_sections_to_parse}, chunks in progress: {len(status)}")
+                if http_summary:
+                    line += f"; HTTP: {http_summary}"
+                print(line, flush=True)
+                _sleep_while_set(self.logging_enabled, max(self.interval, PLAIN_INTERVAL))
+                continue
 
-                print("\033[2K", end='')  # Clear line
-                print(f"{Fore.WHITE}{Style.BRIGHT}Scraping and parsing all sections...{Style.RESET_ALL}")
+            print("\033[2K", end='')  # Clear line
+            print(f"{Fore.WHITE}{Style.BRIGHT}Scraping and parsing all sections...{Style.RESET_ALL}")
+            print("\033[2K", end='')
+            print(f"{Fore.WHITE}{Style.DIM}(Elapsed time: {elapsed_time:.0f} seconds){Style.RESET_ALL}")
+            print("\033[2K", end='')
+            print(f"\tCourses' sections to scrape: {Fore.GREEN}{Style.BRIGHT}{self.courses_sections_to_parse}{Style.RESET_ALL}")
+            print("\033[2K", end='')
+            print(f"\tCourses' sections scraped: {Fore.GREEN}{Style.BRIGHT}{courses_sections_parsed}{Style.RESET_ALL}")
+            num_lines = 4
+            if http_summary:
                 print("\033[2K", end='')
-                print(f"{Fore.WHITE}{Style.DIM}(Elapsed time: {elapsed_time:.0f} seconds){Style.RESET_ALL}")
+                print(f"\t{Fore.WHITE}{Style.DIM}HTTP: {http_summary}{Style.RESET_ALL}")
+                num_lines += 1
+            
+            for (start, end) in status:
+                if status[(start, end)] == -1:
+                    progress = f"{Fore.WHITE}{Style.DIM}Request sent, awaiting response"
+                else:
+                    (parsed, total) = status[(start, end)]
+                    progress = f"{Fore.WHITE}{Style.NORMAL}Parsed sections for {parsed} of {total} courses in chunk."
                 print("\033[2K", end='')
-                print(f"\tCourses' sections to scrape: {Fore.GREEN}{Style.BRIGHT}{self.courses_sections_to_parse}{Style.RESET_ALL}")
+                print(f"\t\t{Fore.WHITE}{Style.NORMAL}Chunk: {Fore.CYAN}{Style.BRIGHT}{start}...{end}{Style.RESET_ALL}: {progress}{Style.RESET_ALL}")
+                num_lines += 1
+            
+            for _ in range(self.num_workers - len(status)):
                 print("\033[2K", end='')
-                print(f"\tCourses' sections scraped: {Fore.GREEN}{Style.BRIGHT}{self.courses_sections_parsed}{Style.RESET_ALL}")
-                
-                for (start, end) in self.status:
-                    if self.status[(start, end)] == -1:
-                        progress = f"{Fore.WHITE}{Style.DIM}Request sent, awaiting response"
-                    else:
-                        (parsed, total) = self.status[(start, end)]
-                        progress = f"{Fore.WHITE}{Style.NORMAL}Parsed sections for {parsed} of {total} courses in chunk."
-                    print("\033[2K", end='')
-                    print(f"\t\t{Fore.WHITE}{Style.NORMAL}Chunk: {Fore.CYAN}{Style.BRIGHT}{start}...{end}{Style.RESET_ALL}: {progress}{Style.RESET_ALL}")
-                
-                for _ in range(self.num_workers - len(self.status)):
-                    print("\033[2K", end='')
-                    print(f"\t\t{Fore.YELLOW}{Style.DIM}1 worker idle{Style.RESET_ALL}")
-                
-                num_lines = 4 + self.num_workers
-                sys.stdout.write(f"\033[{num_lines}A")
-                sys.stdout.flush()
+                print(f"\t\t{Fore.YELLOW}{Style.DIM}1 worker idle{Style.RESET_ALL}")
+                num_lines += 1
+            
+            sys.stdout.write(f"\033[{num_lines}A")
+            sys.stdout.flush()
             time.sleep(self.interval)
             
         # Move to next line after logging ends
-        print("\033[2K", end='')
+        if self.tty:
+            print("\033[2K", end='')
         print("Scraping and parsing all sections complete.")
\ No newline at end of file
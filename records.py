@@ -0,0 +1,218 @@
+from dataclasses import dataclass
+import re
+from sys import intern
+
+# Compact record types for scraped rows. They are converted to the dicts
+# uploaded to the DB only at the upload boundary (see `as_row`); strings that
+# repeat across many rows (course codes, days, times, buildings, instructors)
+# are interned so that each distinct value is stored once.
+
+# Bit of each day in `Meeting.day_mask`, in the notation Testudo uses for days
+DAY_BITS = {"M": 1, "Tu": 2, "W": 4, "Th": 8, "F": 16, "Sa": 32, "Su": 64}
+_DAY_PATTERN = re.compile("|".join(sorted(DAY_BITS, key=len, reverse=True)))
+_TIME_PATTERN = re.compile(r"(\d{1,2}):(\d{2})\s*(am|pm)")
+
+# Shown in place of the room in `str(meeting)` for meetings without one
+UNKNOWN_ROOM = '????'
+
+# Granularity in minutes of the time slot bitmap of a section (see
+# `Section.time_slots`); Testudo times are all multiples of 5 minutes
+SLOT_MINUTES = 5
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+SLOTS_PER_WEEK = 7 * SLOTS_PER_DAY
+# Uploaded bitmaps are zero-padded to this many hex digits, so that they can be
+# cast to `bit(SLOTS_PER_WEEK)` in SQL (see `sql/meeting_details.sql`)
+TIME_SLOTS_DIGITS = SLOTS_PER_WEEK // 4
+
+def parse_days(days: str) -> int:
+    '''
+    Bitmask of the days in e.g. 'MWF' or 'TuTh' (see `DAY_BITS`).
+    '''
+    mask = 0
+    for day in _DAY_PATTERN.findall(days):
+        mask |= DAY_BITS[day]
+    return mask
+
+def parse_time(time: str) -> int | None:
+    '''
+    Minutes since midnight of e.g. '10:00am', or None if not a time.
+    '''
+    match = _TIME_PATTERN.fullmatch(time.strip().lower())
+    if match is None:
+        return None
+    hours = int(match[1]) % 12 + (12 if match[3] == "pm" else 0)
+    return hours * 60 + int(match[2])
+
+@dataclass(slots=True)
+class Meeting:
+    '''
+    One meeting of a section. `kind` is 'InPerson' for meetings with days,
+    times and a building, otherwise one of 'OnlineSync' (with days and times),
+    'OnlineAsync', 'Unspecified' or 'TBA'.
+    '''
+    kind: str
+    days: str | None = None
+    start: str | None = None
+    end: str | None = None
+    building: str | None = None
+    room: str | None = None
+
+    def __str__(self):
+        if self.kind == 'InPerson':
+            room = self.room if self.room is not None else UNKNOWN_ROOM
+            return f'{self.days}-{self.start}-{self.end}-{self.building}-{room}'
+        if self.kind == 'OnlineSync' and self.days is not None:
+            return f'{self.days}-{self.start}-{self.end}-OnlineSync'
+        return self.kind
+
+    @property
+    def day_mask(self) -> int:
+        return 0 if self.days is None else parse_days(self.days)
+
+    @property
+    def start_minutes(self) -> int | None:
+        return None if self.start is None else parse_time(self.start)
+
+    @property
+    def end_minutes(self) -> int | None:
+        return None if self.end is None else parse_time(self.end)
+
+    def time_slots(self) -> int:
+        '''
+        Bitmap of the `SLOT_MINUTES` slots of the week this meeting occupies:
+        bit `day * SLOTS_PER_DAY + minute // SLOT_MINUTES`, with Monday as
+        day 0. 0 for meetings without days or times.
+        '''
+        (start, end) = (self.start_minutes, self.end_minutes)
+        if start is None or end is None or end <= start:
+            return 0
+        first = start // SLOT_MINUTES
+        # The end is exclusive, so back-to-back meetings don't overlap
+        day_slots = ((1 << (-(-end // SLOT_MINUTES) - first)) - 1) << first
+        slots = 0
+        for (day, bit) in enumerate(DAY_BITS.values()):
+            if self.day_mask & bit:
+                slots |= day_slots << (day * SLOTS_PER_DAY)
+        return slots
+
+    def to_dict(self):
+        '''
+        Structured form of the meeting, uploaded alongside `str(meeting)`.
+        '''
+        return {
+            "kind": self.kind,
+            "days": self.day_mask,
+            "start": self.start_minutes,
+            "end": self.end_minutes,
+            "building": self.building,
+            "room": self.room,
+        }
+
+    @classmethod
+    def from_string(cls, meeting: str):
+        '''
+        Inverse of `str(meeting)`.
+        '''
+        parts = meeting.split('-', 3)
+        if len(parts) < 4:
+            return cls(intern(meeting))
+        (days, start, end, location) = parts
+        if location == 'OnlineSync':
+            return cls('OnlineSync', intern(days), intern(start), intern(end))
+        (building, room) = location.split('-', 1)
+        room = intern(room) if room != UNKNOWN_ROOM else None
+        return cls('InPerson', intern(days), intern(start), intern(end), intern(building), room)
+
+@dataclass(slots=True)
+class Course:
+    course_code: str
+    name: str
+    min_credits: int
+    max_credits: int | None
+    gen_eds: list[str] | None
+    conditions: list[str] | None
+    description: str | None
+
+    def to_dict(self):
+        return {
+            "course_code": self.course_code,
+            "name": self.name,
+            "min_credits": self.min_credits,
+            "max_credits": self.max_credits,
+            "gen_eds": self.gen_eds,
+            "conditions": self.conditions,
+            "description": self.description,
+        }
+
+    @classmethod
+    def from_dict(cls, row: dict):
+        return cls(
+            intern(row["course_code"]), row["name"], row["min_credits"], row["max_credits"],
+            intern_all(row["gen_eds"]), row["conditions"], row["description"],
+        )
+
+@dataclass(slots=True)
+class Section:
+    course_code: str
+    sec_code: str
+    instructors: list[str]
+    meetings: list[Meeting]
+    open_seats: int
+    total_seats: int
+    waitlist: int
+    holdfile: str | None
+
+    def to_dict(self):
+        return {
+            "course_code": self.course_code,
+            "sec_code": self.sec_code,
+            "instructors": self.instructors,
+            "meetings": [str(meeting) for meeting in self.meetings],
+            "open_seats": self.open_seats,
+            "total_seats": self.total_seats,
+            "waitlist": self.waitlist,
+            "holdfile": self.holdfile,
+            "meeting_details": [meeting.to_dict() for meeting in self.meetings],
+            "time_slots": format(self.time_slots(), f"0{TIME_SLOTS_DIGITS}x"),
+        }
+
+    def time_slots(self) -> int:
+        '''
+        Union of the `Meeting.time_slots` bitmaps of all meetings. Uploaded as
+        a hex string of `TIME_SLOTS_DIGITS` digits; two sections conflict iff
+        their bitmaps intersect.
+        '''
+        slots = 0
+        for meeting in self.meetings:
+            slots |= meeting.time_slots()
+        return slots
+
+    def conflicts_with(self, other) -> bool:
+        return self.time_slots() & other.time_slots() != 0
+
+    @classmethod
+    def from_dict(cls, row: dict):
+        return cls(
+            intern(row["course_code"]), intern(row["sec_code"]), intern_all(row["instructors"]),
+            [Meeting.from_string(meeting) for meeting in row["meetings"]],
+            row["open_seats"], row["total_seats"], row["waitlist"], row["holdfile"],
+        )
+
+def slots_conflict(a: str, b: str) -> bool:
+    '''
+    Whether two uploaded `time_slots` hex strings intersect.
+    '''
+    return int(a, 16) & int(b, 16) != 0
+
+def intern_all(strings):
+    return None if strings is None else [intern(s) for s in strings]
+
+def as_row(record):
+    '''
+    The dict uploaded to the DB for `record`. Rows that are already dicts
+    (e.g. instructors) are returned unchanged.
+    '''
+    return record.to_dict() if hasattr(record, "to_dict") else record
+
+def as_rows(records):
+    return [as_row(record) for record in records]
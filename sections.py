@@ -1,51 +1,138 @@
-from bs4 import BeautifulSoup
+from __future__ import annotations
 from concurrent.futures import ThreadPoolExecutor
 from functools import partial
+import fetch
+from metrics import metrics
+from parsing import make_soup, make_parse_pool, index_by_id
+from pipeline import map_isolating_failures, retry_failures, fair_share
 from progress import SectionScrapingProgress
-import requests
-
-# Logging progress
-sections_progress = SectionScrapingProgress()
-
-# Attempts to send the request a total of 3 times by default.
-# Testudo can be flaky sometimes.
-def send_request(uri: str, attempts_remaining=2) -> BeautifulSoup:
-    headers = {
-        "User-Agent": "Mozilla/5.0",
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
-
-    response = requests.post(uri, headers=headers)
-    if response.status_code != 200:
-        if attempts_remaining > 0:
-            return send_request(uri, attempts_remaining - 1)
-        else:
-            raise Exception(f"Failed to fetch data: {response.status_code}")
-    
-    return BeautifulSoup(response.text, features='html.parser')
+from records import Meeting, Section, as_rows
+from sys import intern
+import queue
+import threading
+import time
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
+
+# Logging progress, created on first use
+_sections_progress = None
+_sections_progress_lock = threading.Lock()
+
+def get_sections_progress() -> SectionScrapingProgress:
+    global _sections_progress
+    with _sections_progress_lock:
+        if _sections_progress is None:
+            _sections_progress = SectionScrapingProgress()
+        return _sections_progress
+
+# Default number of courses requested per sections page, and the longest URL
+# we'll send to Testudo (long query strings get rejected by some servers).
+CHUNK_SIZE = 100
+MAX_URL_LENGTH = 4000
+
+def chunk_end(items, start: int, max_courses: int, term: str, max_url_length=MAX_URL_LENGTH):
+    '''
+    Index one past the last item of the chunk starting at `start`, with at
+    most `max_courses` items and a URL no longer than `max_url_length`.
+    '''
+    url_length = len(chunk_url([], term))
+    end = start
+    while end < len(items) and end - start < max_courses:
+        url_length += len(items[end]) + (1 if end > start else 0)
+        # Always take at least one course so we make progress
+        if url_length > max_url_length and end > start:
+            break
+        end += 1
+    return end
+
+def split_into_chunks(items, chunk_size: int, term: str, max_url_length=MAX_URL_LENGTH):
+    chunks = []
+    start = 0
+    while start < len(items):
+        end = chunk_end(items, start, chunk_size, term, max_url_length)
+        chunks.append(items[start:end])
+        start = end
+    return chunks
+
+class AdaptiveChunker:
+    '''
+    Shared work queue of course codes. Each worker takes the next chunk when it
+    becomes idle, and chunk sizes are adjusted from the observed time and size
+    of previous responses so that each request takes about `target_seconds`
+    and returns at most `max_bytes`.
+    '''
+    def __init__(self, items, term: str, initial_size=CHUNK_SIZE, target_seconds=5.0,
+                 max_bytes=8_000_000, min_size=10, max_size=500, max_url_length=MAX_URL_LENGTH):
+        self.items = items
+        self.term = term
+        self.size = initial_size
+        self.target_seconds = target_seconds
+        self.max_bytes = max_bytes
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_url_length = max_url_length
+        self.next_start = 0
+        self.chunks_issued = 0
+        self.seconds_per_course = None
+        self.bytes_per_course = None
+        self.lock = threading.Lock()
 
-def split_into_chunks(items, num_chunks):
-    k, m = divmod(len(items), num_chunks)
-    return [items[i*k + min(i, m):(i+1)*k + min(i+1, m)] for i in range(num_chunks)]
+    def next_chunk(self):
+        '''
+        Returns `(index, chunk)` for the next chunk, or None if all courses
+        have been handed out. `index` is used to restore the original order.
+        '''
+        with self.lock:
+            if self.next_start >= len(self.items):
+                return None
+            end = chunk_end(self.items, self.next_start, self.size, self.term, self.max_url_length)
+            chunk = self.items[self.next_start:end]
+            self.next_start = end
+            index = self.chunks_issued
+            self.chunks_issued += 1
+            return (index, chunk)
+
+    def record(self, num_courses: int, seconds: float, num_bytes: int):
+        with self.lock:
+            # Exponentially weighted averages, so a single slow response
+            # doesn't shrink every following chunk
+            seconds_per_course = seconds / num_courses
+            bytes_per_course = num_bytes / num_courses
+            if self.seconds_per_course is None:
+                self.seconds_per_course = seconds_per_course
+                self.bytes_per_course = bytes_per_course
+            else:
+                self.seconds_per_course = 0.5 * self.seconds_per_course + 0.5 * seconds_per_course
+                self.bytes_per_course = 0.5 * self.bytes_per_course + 0.5 * bytes_per_course
+
+            size = self.target_seconds / max(self.seconds_per_course, 1e-6)
+            size = min(size, self.max_bytes / max(self.bytes_per_course, 1))
+            self.size = int(max(self.min_size, min(self.max_size, size)))
 
 def parse_async_class(div: BeautifulSoup):
     online_classroom = div.find('span', class_='class-room')
     if online_classroom != None:
-        return 'OnlineAsync'
-    return 'Unspecified'
+        return Meeting('OnlineAsync')
+    return Meeting('Unspecified')
 
 def get_location(div: BeautifulSoup):
+    '''
+    Returns `(building, classroom)`, or None for online synchronous classes.
+    `classroom` is None if Testudo doesn't list one.
+    '''
     location = div.find('span', class_='class-building')
     try_building = location.find('span', class_='building-code')
     try_classroom = location.find('span', class_='class-room')
 
     if try_building == None:
-        return 'OnlineSync'
+        return None
     
     building = try_building.get_text()
-    classroom = try_classroom.get_text() if try_classroom != None else '????'
+    classroom = intern(try_classroom.get_text()) if try_classroom != None else None
 
-    return f'{building}-{classroom}'
+    return (intern(building), classroom)
 
 def parse_meeting(div: BeautifulSoup):
     try_days = div.find('span', class_='section-days')
@@ -54,19 +141,22 @@ def parse_meeting(div: BeautifulSoup):
     
     days = try_days.get_text()
     if days == 'TBA':
-        return 'TBA'
+        return Meeting('TBA')
 
-    start = div.find('span', class_='class-start-time').get_text()
-    end = div.find('span', class_='class-end-time').get_text()
+    start = intern(div.find('span', class_='class-start-time').get_text())
+    end = intern(div.find('span', class_='class-end-time').get_text())
 
     location = get_location(div)
+    if location is None:
+        return Meeting('OnlineSync', intern(days), start, end)
 
-    return f'{days}-{start}-{end}-{location}'
+    (building, classroom) = location
+    return Meeting('InPerson', intern(days), start, end, building, classroom)
 
 def parse_section(div: BeautifulSoup, course: str):
     sec_code = div.find('input', {'name': 'sectionId'})['value']
     instructors = list(
-        map(lambda x: x.get_text(),
+        map(lambda x: intern(x.get_text()),
             div.find_all('span', class_='section-instructor')))
     meetings_divs = div.select('.class-days-container .row')
     meetings = list(map(parse_meeting, meetings_divs))
@@ -76,22 +166,24 @@ def parse_section(div: BeautifulSoup, course: str):
     waitlist = int(try_waitlist_holdfile[0].get_text())
     holdfile = None if len(try_waitlist_holdfile) == 1 else try_waitlist_holdfile[1].get_text()
     
-    return {
-        "course_code": course,
-        "sec_code": sec_code,
-        "instructors": instructors,
-        "meetings": meetings,
-        "open_seats": open_seats,
-        "total_seats": total_seats,
-        "waitlist": waitlist,
-        "holdfile": holdfile
-    }
-
-def sections_for_course(course: str, page: BeautifulSoup, chunk_start: str, chunk_end: str):
-    course_div = page.find('div', id=course)
+    return Section(
+        course_code=intern(course),
+        sec_code=intern(sec_code),
+        instructors=instructors,
+        meetings=meetings,
+        open_seats=open_seats,
+        total_seats=total_seats,
+        waitlist=waitlist,
+        holdfile=holdfile,
+    )
+
+def sections_for_course(course: str, course_divs: dict, chunk_start: str, chunk_end: str, track_progress=True):
+    course_div = course_divs.get(course)
     
     # some courses have no sections
     if course_div == None:
+        if track_progress:
+            get_sections_progress().increment_chunk_courses_parsed(chunk_start, chunk_end)
         return []
 
     sections = course_div.find_all('div', class_='section')
@@ -99,31 +191,228 @@ def sections_for_course(course: str, page: BeautifulSoup, chunk_start: str, chun
     result = list(
         map(section_with_sections_div, filter(lambda x: x != None, sections))
     )
-    sections_progress.increment_chunk_courses_parsed(chunk_start, chunk_end)
+    if track_progress:
+        get_sections_progress().increment_chunk_courses_parsed(chunk_start, chunk_end)
     return result
 
-def get_sections_for_chunk(chunk: list[str], term: str):
+def get_sections_for_chunk(chunk: list[str], term: str, parse_pool=None, chunker=None, cache=None, checkpoint=None):
+    '''
+    If `parse_pool` is given, the page is parsed in that process pool instead
+    of the current thread. If `chunker` is given, the response time and size
+    are reported to it. If `cache` is given, the page is revalidated against it
+    and previous results are reused if the page is unchanged. If `checkpoint`
+    is given, the results are recorded in it, and taken from it without any
+    request when resuming.
+    '''
     if len(chunk) == 0:
         return []
 
-    sections_progress.mark_chunk_sending_req(chunk[0], chunk[-1])
-    url = f'https://app.testudo.umd.edu/soc/{term}/sections?courseIds=' + ','.join(chunk)
-    chunk_page = send_request(url)
-    sections_progress.mark_chunk_parsing(chunk[0], chunk[-1], len(chunk))
+    url = chunk_url(chunk, term)
+    if checkpoint is not None and (rows := checkpoint.get(url)) is not None:
+        result = [Section.from_dict(row) for row in rows]
+        record_chunk_result(chunk, term)
+        return result
+
+    try:
+        result = scrape_chunk(chunk, term, parse_pool=parse_pool, chunker=chunker, cache=cache)
+    except Exception:
+        get_sections_progress().mark_chunk_failed(get_sections_progress().label(chunk[0], term), chunk[-1])
+        raise
+    if checkpoint is not None:
+        checkpoint.store(url, as_rows(result))
+    return result
+
+def scrape_chunk(chunk: list[str], term: str, parse_pool=None, chunker=None, cache=None):
+    start_label = get_sections_progress().label(chunk[0], term)
+    get_sections_progress().mark_chunk_sending_req(start_label, chunk[-1])
+    url = chunk_url(chunk, term)
+    start = time.perf_counter()
+    if cache is None:
+        page = fetch.send_request(url)
+    else:
+        entry = cache.get(url)
+        (page, headers) = fetch.send_conditional_request(url, cache.validators(entry))
+        rows = cache.reuse(entry, page)
+        if rows is not None:
+            result = [Section.from_dict(row) for row in rows]
+            record_chunk_result(chunk, term)
+            return result
+        if page is None:
+            # 304 for an entry that has since been evicted
+            page = fetch.send_request(url)
+    if chunker is not None:
+        chunker.record(len(chunk), time.perf_counter() - start, len(page))
+
+    with metrics.time("parse_seconds", f"{start_label}...{chunk[-1]}", kind="chunk"):
+        if parse_pool is None:
+            result = parse_chunk_page(chunk, page, term=term)
+        else:
+            # Progress can't be tracked from another process; record the chunk here
+            result = parse_pool.submit(parse_chunk_page, chunk, page, track_progress=False).result()
+            record_chunk_result(chunk, term)
 
-    sections_for_course_with_page = partial(sections_for_course, page=chunk_page, chunk_start=chunk[0], chunk_end=chunk[-1])
-    sections = list(map(sections_for_course_with_page, chunk))
-    sections_progress.mark_chunk_complete(chunk[0], chunk[-1])
+    if cache is not None:
+        cache.store(url, page, headers, as_rows(result))
+    return result
+
+def record_chunk_result(chunk: list[str], term=None):
+    '''
+    Updates progress for a chunk whose results were not parsed in this process.
+    '''
+    start_label = get_sections_progress().label(chunk[0], term)
+    get_sections_progress().mark_chunk_parsing(start_label, chunk[-1], len(chunk))
+    # Every course of the chunk is done, including those without sections
+    get_sections_progress().increment_chunk_courses_parsed(start_label, chunk[-1], len(chunk))
+    get_sections_progress().mark_chunk_complete(start_label, chunk[-1])
+
+def chunk_url(chunk: list[str], term: str):
+    return f'https://app.testudo.umd.edu/soc/{term}/sections?courseIds=' + ','.join(chunk)
+
+def parse_chunk_page(chunk: list[str], page: str, track_progress=True, term=None):
+    start_label = get_sections_progress().label(chunk[0], term)
+    if track_progress:
+        get_sections_progress().mark_chunk_parsing(start_label, chunk[-1], len(chunk))
+    chunk_page = make_soup(page)
+
+    course_divs = index_by_id(chunk_page, chunk)
+    sections_for_course_with_divs = partial(sections_for_course, course_divs=course_divs, chunk_start=start_label,
+                                            chunk_end=chunk[-1], track_progress=track_progress)
+    sections = list(map(sections_for_course_with_divs, chunk))
+    # Release the tree now rather than whenever it is garbage collected
+    chunk_page.decompose()
+
+    if track_progress:
+        get_sections_progress().mark_chunk_complete(start_label, chunk[-1])
     return [section for sublist in sections for section in sublist]
 
-def scrape_sections(term: str, course_codes):
-    chunks = split_into_chunks(items=course_codes, num_chunks=20)
-    get_sections_for_chunk_with_term = partial(get_sections_for_chunk, term=term)
+def scrape_sections(term: str, course_codes, parse_processes=0, chunk_size=CHUNK_SIZE, adaptive=False, cache=None):
+    '''
+    `parse_processes`: if nonzero, parse pages in this many processes while
+    threads do the fetching
+
+    `chunk_size`: number of courses per request; with `adaptive`, only the
+    size of the first chunks, after which it follows observed response times
+
+    `cache`: optional `ResponseCache` of previously parsed chunk pages
+    '''
+    return list(iter_sections(term, course_codes, parse_processes=parse_processes, chunk_size=chunk_size,
+                              adaptive=adaptive, cache=cache))
+
+def scrape_sections_for_terms(course_codes_by_term: dict, parse_processes=0, chunk_size=CHUNK_SIZE, adaptive=False,
+                              cache=None, checkpoint=None):
+    '''
+    Like `scrape_sections`, but for several terms at once, given a dict of
+    each term's course codes. Returns a dict of each term's sections.
+    '''
+    result = {term: [] for term in course_codes_by_term}
+    for (term, sections) in iter_sections_for_terms(course_codes_by_term, parse_processes=parse_processes,
+                                                    chunk_size=chunk_size, adaptive=adaptive, cache=cache,
+                                                    checkpoint=checkpoint):
+        result[term] += sections
+    return result
+
+def iter_sections(term: str, course_codes, parse_processes=0, chunk_size=CHUNK_SIZE, adaptive=False, cache=None):
+    '''
+    Generator version of `scrape_sections`, yielding sections one chunk at a
+    time as they are parsed. Only a few chunks are fetched ahead of the
+    consumer.
+    '''
+    for (_, sections) in iter_sections_for_terms({term: course_codes}, parse_processes=parse_processes,
+                                                 chunk_size=chunk_size, adaptive=adaptive, cache=cache):
+        yield from sections
+
+def iter_sections_for_terms(course_codes_by_term: dict, parse_processes=0, chunk_size=CHUNK_SIZE, adaptive=False,
+                            cache=None, checkpoint=None):
+    '''
+    Yields `(term, sections)` for each chunk of each term. All terms share the
+    same workers, with requests alternating between terms. With `adaptive`,
+    each term's chunks are sized by their own `AdaptiveChunker` and the terms
+    are scraped one after another.
+
+    A chunk that fails doesn't stop the others; it is retried at the end, and
+    `UnitsFailedError` is raised if it still fails.
+    '''
     workers = 5
-    sections_progress.courses_sections_to_parse = len(course_codes)
-    sections_progress.start_logging(num_workers=workers)
+    get_sections_progress().reset()
+    get_sections_progress().multi_term = len(course_codes_by_term) > 1
+    get_sections_progress().courses_sections_to_parse = sum(len(codes) for codes in course_codes_by_term.values())
+    fetch.get_session(pool_size=workers)
+    get_sections_progress().start_logging(num_workers=workers, request_stats=fetch.request_stats)
+    try:
+        with make_parse_pool(parse_processes) as parse_pool:
+            if adaptive:
+                for (term, course_codes) in course_codes_by_term.items():
+                    for sections in iter_adaptive_chunks(term, course_codes, workers, parse_pool, chunk_size, cache,
+                                                         checkpoint):
+                        yield (term, sections)
+            else:
+                def get_sections(item):
+                    (term, chunk) = item
+                    return (term, get_sections_for_chunk(chunk, term, parse_pool=parse_pool, cache=cache,
+                                                         checkpoint=checkpoint))
+                items = fair_share({
+                    term: split_into_chunks(course_codes, chunk_size, term)
+                    for (term, course_codes) in course_codes_by_term.items()
+                })
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    yield from map_isolating_failures(executor, get_sections, items, max_pending=2 * workers,
+                                                      describe=lambda item: chunk_url(item[1], item[0]))
+    finally:
+        get_sections_progress().stop_logging()
+
+def iter_adaptive_chunks(term: str, course_codes, workers: int, parse_pool, chunk_size: int, cache, checkpoint=None):
+    '''
+    Yields each chunk's sections in course order. Workers stop taking new
+    chunks while `workers` finished chunks are waiting to be consumed. Chunks
+    that fail are retried at the end, after all other chunks.
+    '''
+    chunker = AdaptiveChunker(course_codes, term, initial_size=chunk_size)
+    finished = queue.Queue(maxsize=workers)
+    stopped = threading.Event()
+    failures = []
+
+    def get_sections(chunk):
+        return get_sections_for_chunk(chunk, term, parse_pool=parse_pool, chunker=chunker, cache=cache,
+                                      checkpoint=checkpoint)
+
+    def worker():
+        try:
+            while not stopped.is_set() and (next_chunk := chunker.next_chunk()) is not None:
+                (index, chunk) = next_chunk
+                try:
+                    sections = get_sections(chunk)
+                except Exception as e:
+                    print(f"Failed {chunk_url(chunk, term)}: {e!r}; retrying at the end of the run.")
+                    metrics.increment("failed_units_total")
+                    failures.append((chunk, e))
+                    # Keeps the following chunks in order
+                    sections = []
+                finished.put((index, sections))
+        finally:
+            finished.put(None)
+
     with ThreadPoolExecutor(max_workers=workers) as executor:
-        sections_lists = list(executor.map(get_sections_for_chunk_with_term, chunks))
-    sections_progress.stop_logging()
-    sections = [section for sublist in sections_lists for section in sublist]
-    return sections
\ No newline at end of file
+        futures = [executor.submit(worker) for _ in range(workers)]
+        results = dict()
+        next_index = 0
+        workers_done = 0
+        try:
+            while workers_done < workers:
+                item = finished.get()
+                if item is None:
+                    workers_done += 1
+                    continue
+                (index, sections) = item
+                results[index] = sections
+                while next_index in results:
+                    yield results.pop(next_index)
+                    next_index += 1
+        finally:
+            # Unblock workers if the consumer stopped early
+            stopped.set()
+            while workers_done < workers:
+                if finished.get() is None:
+                    workers_done += 1
+        for future in futures:
+            future.result()
+    yield from retry_failures(get_sections, failures, describe=lambda chunk: chunk_url(chunk, term))
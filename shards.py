@@ -0,0 +1,177 @@
+import glob
+import hashlib
+import json
+import os
+import re
+import threading
+from records import as_row
+
+# Splitting one scrape across several runners: each runner (`--shard i/N`)
+# scrapes a deterministic part of the departments or course codes and writes
+# its rows to a partial artifact instead of the DB, and a final `--merge` step
+# combines all artifacts and uploads them at once.
+
+class Shard:
+    '''
+    Shard `index` (0-based) of `count`. Items are ordered by a hash of their
+    name and split into `count` runs of roughly equal total cost, using the
+    costs recorded by the last merge (see `save_costs`); items without a
+    recorded cost count as the average cost. Every runner must use the same
+    costs file so that the shards don't overlap or leave items out.
+    '''
+    def __init__(self, index: int, count: int, costs=None):
+        if not 0 <= index < count:
+            raise ValueError(f"Shard index {index} is out of range for {count} shards")
+        self.index = index
+        self.count = count
+        self.costs = costs if costs is not None else {"depts": {}, "courses": {}}
+
+    @classmethod
+    def parse(cls, spec: str, costs_path=None):
+        '''
+        Parses a shard given as `i/N`, loading costs from `costs_path` if given.
+        '''
+        match = re.fullmatch(r"(\d+)/(\d+)", spec)
+        if match is None:
+            raise ValueError(f"Invalid shard '{spec}'; expected 'i/N', e.g. '0/4'")
+        return cls(int(match[1]), int(match[2]), load_costs(costs_path))
+
+    def select(self, items, costs: dict):
+        '''
+        The items of `items` that belong to this shard.
+        '''
+        items = sorted(set(items), key=lambda item: (_hash(item), item))
+        known = [costs[item] for item in items if item in costs]
+        default_cost = sum(known) / len(known) if known else 1
+        weights = [max(costs.get(item, default_cost), 1) for item in items]
+        total = sum(weights)
+
+        # Each item goes to the shard containing the midpoint of its cost range
+        selected = []
+        cumulative = 0
+        for (item, weight) in zip(items, weights):
+            midpoint = cumulative + weight / 2
+            cumulative += weight
+            if min(int(midpoint * self.count / total), self.count - 1) == self.index:
+                selected.append(item)
+        return selected
+
+    def select_depts(self, depts):
+        return self.select(depts, self.costs["depts"])
+
+    def select_courses(self, course_codes):
+        return self.select(course_codes, self.costs["courses"])
+
+    def __str__(self):
+        return f"{self.index}-of-{self.count}"
+
+def _hash(item: str) -> str:
+    # Unlike `hash`, stable across processes
+    return hashlib.sha1(item.encode()).hexdigest()
+
+def load_costs(path):
+    if not path:
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def save_costs(path: str, tables: dict):
+    '''
+    Records the cost of each department (its number of courses) and each
+    course (its number of sections) from merged `tables`, for future shards.
+    '''
+    costs = {"depts": {}, "courses": {}}
+    for (table, rows) in tables.items():
+        if table.startswith("courses"):
+            for row in rows:
+                dept = row["course_code"][:4]
+                costs["depts"][dept] = costs["depts"].get(dept, 0) + 1
+        elif table.startswith("sections"):
+            for row in rows:
+                course = row["course_code"]
+                costs["courses"][course] = costs["courses"].get(course, 0) + 1
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(costs, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+class ShardWriter:
+    '''
+    Writes the rows of each table scraped by `shard` to
+    `<directory>/<table>.<shard>.jsonl`. A manifest is written by `finish`, so
+    that shards that didn't complete are detected when merging.
+    '''
+    def __init__(self, directory: str, shard: Shard, terms: list[str]):
+        self.directory = directory
+        self.shard = shard
+        self.terms = terms
+        self.counts = dict()
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # Leftovers from an earlier run of the same shard
+        for path in glob.glob(os.path.join(directory, f"*.{shard}.*")):
+            os.remove(path)
+
+    def upload(self, rows, table: str):
+        '''
+        Same role as `db.upload_stream`: writes `rows`, which may be an
+        iterator, as the shard's rows of `table`. Returns the number of rows.
+        '''
+        count = 0
+        with open(os.path.join(self.directory, f"{table}.{self.shard}.jsonl"), "a") as f:
+            for row in rows:
+                f.write(json.dumps(as_row(row), separators=(',', ':')))
+                f.write("\n")
+                count += 1
+        with self.lock:
+            self.counts[table] = self.counts.get(table, 0) + count
+        print(f"Wrote {count} rows of {table} for shard {self.shard}.")
+        return count
+
+    def finish(self):
+        manifest = {
+            "shard": self.shard.index,
+            "count": self.shard.count,
+            "terms": self.terms,
+            "tables": self.counts,
+        }
+        with open(os.path.join(self.directory, f"manifest.{self.shard}.json"), "w") as f:
+            json.dump(manifest, f)
+
+def read_shards(directory: str, terms: list[str]) -> dict:
+    '''
+    Reads the artifacts of all shards in `directory`, returning a dict of
+    each table's rows. Raises `ValueError` unless every shard completed for
+    the same `terms`.
+    '''
+    manifests = []
+    for path in glob.glob(os.path.join(directory, "manifest.*.json")):
+        with open(path) as f:
+            manifests.append(json.load(f))
+    if not manifests:
+        raise ValueError(f"No shard manifests found in {directory}")
+
+    count = manifests[0]["count"]
+    indices = sorted(manifest["shard"] for manifest in manifests)
+    if indices != list(range(count)) or any(manifest["count"] != count for manifest in manifests):
+        raise ValueError(f"Expected shards 0 to {count - 1} in {directory}, found {indices}")
+    for manifest in manifests:
+        if manifest["terms"] != terms:
+            raise ValueError(f"Shard {manifest['shard']} scraped terms {manifest['terms']}, not {terms}")
+
+    tables = dict()
+    for manifest in sorted(manifests, key=lambda manifest: manifest["shard"]):
+        shard = f"{manifest['shard']}-of-{count}"
+        for (table, expected) in manifest["tables"].items():
+            with open(os.path.join(directory, f"{table}.{shard}.jsonl")) as f:
+                rows = [json.loads(line) for line in f]
+            if len(rows) != expected:
+                raise ValueError(f"Shard {shard} has {len(rows)} rows of {table}, expected {expected}")
+            tables.setdefault(table, []).extend(rows)
+    return tables
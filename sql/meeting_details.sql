@@ -0,0 +1,39 @@
+-- Structured meeting fields uploaded by `records.Section.to_dict` alongside
+-- the legacy `meetings` strings:
+--
+--   meeting_details: one object per meeting with `kind`, `days` (bitmask,
+--     Monday = 1 through Sunday = 64), `start` and `end` (minutes since
+--     midnight), `building` and `room` (null if Testudo lists none)
+--   time_slots: bitmap of the 5-minute slots of the week the section
+--     occupies (bit `day * 288 + minute / 5` counting from the right, Monday
+--     = day 0) as 504 zero-padded hex digits; `('x' || time_slots)::bit(2016)`
+--     converts it to a bit string, and two sections conflict iff their
+--     bitmaps intersect (see `time_slots_conflict`)
+--
+-- Every sections table gets the columns: the primary term's, those of other
+-- terms (`sections_<term>`) and their staging tables, since `swap_staging`
+-- copies `*`. Run again after creating the tables of a new term, unless they
+-- were created `like sections`.
+do $$
+declare
+    t text;
+begin
+    for t in
+        select table_name from information_schema.tables
+        where table_schema = 'public' and table_name ~ '^sections(_[0-9]{6})?(_staging)?$'
+    loop
+        execute format('alter table %I add column if not exists meeting_details jsonb', t);
+        execute format('alter table %I add column if not exists time_slots text', t);
+        -- Bitmaps uploaded before they were zero-padded have varying lengths
+        execute format('update %I set time_slots = lpad(time_slots, 504, ''0'') where length(time_slots) < 504', t);
+    end loop;
+end;
+$$;
+
+create or replace function time_slots_conflict(a text, b text)
+returns boolean
+language sql
+immutable
+as $$
+    select position(B'1' in ('x' || a)::bit(2016) & ('x' || b)::bit(2016)) > 0
+$$;
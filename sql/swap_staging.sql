@@ -0,0 +1,20 @@
+-- Replaces the contents of `target` with the contents of `<target>_staging`
+-- in a single transaction, so readers see either the old or the new data.
+-- Used by `db.upload_data(..., staging=True)`. Each staging table must have
+-- the same columns as its target, e.g.:
+--
+--     create table sections_staging (like sections including all);
+create or replace function swap_staging(target text)
+returns void
+language plpgsql
+security definer
+as $$
+begin
+    -- Tables of terms other than the primary one are suffixed with the term
+    if target !~ '^(courses|sections|instructors)(_[0-9]{6})?$' then
+        raise exception 'Unknown table %', target;
+    end if;
+    execute format('delete from %I', target);
+    execute format('insert into %I select * from %I', target, target || '_staging');
+end;
+$$;
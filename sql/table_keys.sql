@@ -0,0 +1,37 @@
+-- Unique keys that uploads upsert on (see `db.TABLE_KEYS`): PostgREST only
+-- accepts `on_conflict` columns backed by a unique constraint. Added to every
+-- courses, sections and instructors table, including those of other terms
+-- (`<table>_<term>`) and staging tables. Run again after creating the tables
+-- of a new term, unless they were created `like <table> including all`.
+do $$
+declare
+    t text;
+    key_columns text;
+begin
+    for t, key_columns in
+        select table_name,
+            case
+                when table_name ~ '^sections' then 'course_code, sec_code'
+                when table_name ~ '^courses' then 'course_code'
+                else 'slug'
+            end
+        from information_schema.tables
+        where table_schema = 'public'
+            and table_name ~ '^(courses|sections|instructors)(_[0-9]{6})?(_staging)?$'
+    loop
+        if not exists (
+            select 1 from pg_constraint
+            where conrelid = format('public.%I', t)::regclass and conname = t || '_key'
+        ) then
+            -- Duplicates left by earlier non-idempotent retries would block the constraint
+            execute format(
+                'delete from %I a using %I b where (%s) = (%s) and a.ctid > b.ctid',
+                t, t,
+                (select string_agg('a.' || trim(col), ', ') from unnest(string_to_array(key_columns, ',')) col),
+                (select string_agg('b.' || trim(col), ', ') from unnest(string_to_array(key_columns, ',')) col)
+            );
+            execute format('alter table %I add constraint %I unique (%s)', t, t || '_key', key_columns);
+        end if;
+    end loop;
+end;
+$$;
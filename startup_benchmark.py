@@ -0,0 +1,70 @@
+import argparse
+import re
+import subprocess
+import sys
+
+# Guards the startup time of `main.py`, which runs every 30 minutes for
+# sections: imports `main` in a fresh interpreter with `-X importtime` and
+# reports the total import time and the slowest modules.
+#
+#   python3 startup_benchmark.py --max-ms 300
+#
+# Exits with an error if importing takes longer than `--max-ms`, or if any of
+# `DEFERRED_MODULES` is imported at startup rather than by the code that
+# needs it (e.g. `supabase` before the first DB request). Runs as its own
+# check (`.github/workflows/startup.yml`), so a slow runner never holds up a
+# scrape.
+
+DEFERRED_MODULES = ["supabase", "bs4", "colorama", "httpx", "tabulate", "requests", "pyarrow"]
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure the import time of main.py")
+    parser.add_argument("--module", default="main", help="Module to import")
+    parser.add_argument("--runs", type=int, default=5, help="Number of fresh interpreters to time; the fastest run is reported")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest modules to list")
+    parser.add_argument("--max-ms", type=float, help="Exit with an error if importing takes longer than this")
+    return parser.parse_args()
+
+def measure(module: str):
+    '''
+    Imports `module` in a new interpreter, returning the cumulative import
+    time in microseconds of each module it imported (directly or not).
+    '''
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+    times = dict()
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            times[match[4]] = int(match[2])
+    return times
+
+def main():
+    args = parse_args()
+    runs = [measure(args.module) for _ in range(args.runs)]
+    # The fastest run has the least noise from the rest of the machine
+    times = min(runs, key=lambda times: times.get(args.module, 0))
+    total_ms = times.get(args.module, 0) / 1000
+
+    print(f"Importing {args.module}: {total_ms:.1f} ms (fastest of {args.runs})")
+    slowest = sorted(((us, name) for (name, us) in times.items() if name != args.module), reverse=True)
+    for (us, name) in slowest[:args.top]:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+
+    problems = []
+    if args.max_ms is not None and total_ms > args.max_ms:
+        problems.append(f"Import time {total_ms:.1f} ms is over the limit of {args.max_ms} ms")
+    eager = sorted(name for name in DEFERRED_MODULES if name in times)
+    if eager:
+        problems.append(f"Imported at startup: {', '.join(eager)}")
+    if problems:
+        sys.exit("\n".join(problems))
+
+if __name__ == "__main__":
+    main()
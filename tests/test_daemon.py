@@ -0,0 +1,59 @@
+import argparse
+import daemon
+
+def make_args(**flags):
+    args = argparse.Namespace(courses=False, sections=False, instructors=False, snapshot_max_age=60,
+                              courses_interval=720, sections_interval=30, instructors_interval=1440, jitter=0)
+    for (flag, value) in flags.items():
+        setattr(args, flag, value)
+    return args
+
+class FakeRunOnce:
+    '''
+    Stands in for `main.run_once`: returns the known course codes if given,
+    otherwise the ones in the DB.
+    '''
+    def __init__(self):
+        self.db_course_codes = {"202601": ["CMSC131"]}
+        self.known = []
+
+    def __call__(self, args, cache, known_course_codes=None):
+        self.known.append(known_course_codes)
+        if args.courses or known_course_codes is None:
+            return {term: list(codes) for (term, codes) in self.db_course_codes.items()}
+        return known_course_codes
+
+def test_sections_runs_pick_up_new_courses(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(daemon.time, "monotonic", lambda: now[0])
+    run_once = FakeRunOnce()
+    [sections] = daemon.make_jobs(make_args(sections=True), None, run_once)
+
+    sections.fn()
+    assert run_once.known == [None]
+    # Within the max age, the downloaded codes are reused
+    run_once.db_course_codes["202601"].append("CMSC132")
+    now[0] += 30 * 60
+    sections.fn()
+    assert run_once.known[-1] == {"202601": ["CMSC131"]}
+    # Afterwards, they are downloaded again, including the new course
+    now[0] += 31 * 60
+    sections.fn()
+    assert run_once.known[-1] is None
+    now[0] += 1
+    sections.fn()
+    assert run_once.known[-1] == {"202601": ["CMSC131", "CMSC132"]}
+
+def test_sections_runs_use_codes_of_latest_courses_run(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(daemon.time, "monotonic", lambda: now[0])
+    run_once = FakeRunOnce()
+    [courses, sections] = daemon.make_jobs(make_args(courses=True, sections=True), None, run_once)
+
+    courses.fn()
+    sections.fn()
+    assert run_once.known[-1] == {"202601": ["CMSC131"]}
+    run_once.db_course_codes["202601"].append("CMSC132")
+    courses.fn()
+    sections.fn()
+    assert run_once.known[-1] == {"202601": ["CMSC131", "CMSC132"]}
@@ -0,0 +1,30 @@
+import pytest
+
+pytest.importorskip("requests")
+import fetch
+
+class FakeResponse:
+    status_code = 200
+    content = b"ok"
+    text = "ok"
+
+@pytest.fixture
+def session(monkeypatch):
+    # A fresh session whose requests never reach the network
+    monkeypatch.setattr(fetch, "_session", None)
+    monkeypatch.setattr(fetch, "_pool_size", 0)
+    session = fetch.get_session(pool_size=4)
+    monkeypatch.setattr(session, "request", lambda *args, **kwargs: FakeResponse())
+    return session
+
+def test_requests_keep_pool_sized_to_workers(session):
+    assert fetch.send_request("https://app.testudo.umd.edu/soc/202601/CMSC") == "ok"
+    assert fetch.get_session(pool_size=0) is session
+    assert fetch._pool_size == 4
+    assert session.get_adapter("https://app.testudo.umd.edu")._pool_maxsize == 4
+
+def test_pool_grows_for_more_workers(session):
+    fetch.get_session(pool_size=8)
+    assert session.get_adapter("https://app.testudo.umd.edu")._pool_maxsize == 8
+    fetch.send_request("https://app.testudo.umd.edu/soc/202601/CMSC")
+    assert session.get_adapter("https://app.testudo.umd.edu")._pool_maxsize == 8
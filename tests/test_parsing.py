@@ -0,0 +1,48 @@
+import pytest
+
+bs4_filter = pytest.importorskip("bs4.filter")
+from courses import parse_dept_page
+from parsing import index_by_id, make_soup
+
+def dept_page(num_courses: int) -> str:
+    # Just enough of a Testudo department page for `parse_dept_page`
+    courses = "".join(
+        f'<div id="CMSC{i:03d}" class="course">'
+        f'<div class="course-id">CMSC{i:03d}</div>'
+        f'<span class="course-title">Course {i}</span>'
+        f'<span class="course-min-credits">3</span>'
+        f'<div class="course-text">Description {i}</div>'
+        f'</div>'
+        for i in range(num_courses)
+    )
+    return f'<html><body><div id="courses-page">{courses}</div></body></html>'
+
+def count_rule_checks(monkeypatch, fn):
+    # Number of times bs4 matched a tag or attribute against a rule in `fn`
+    checks = 0
+    matches_string = bs4_filter.MatchRule.matches_string
+
+    def counting(self, string):
+        nonlocal checks
+        checks += 1
+        return matches_string(self, string)
+
+    monkeypatch.setattr(bs4_filter.MatchRule, "matches_string", counting)
+    result = fn()
+    monkeypatch.setattr(bs4_filter.MatchRule, "matches_string", matches_string)
+    return (checks, result)
+
+def test_index_by_id_keeps_first_match():
+    doc = make_soup('<div id="a">1</div><span id="a">2</span><div id="b">3</div><div id="c">4</div>')
+    tags = index_by_id(doc, ["a", "b"], name=None)
+    assert {id: tag.get_text() for (id, tag) in tags.items()} == {"a": "1", "b": "3"}
+    assert index_by_id(doc, ["a"])["a"].get_text() == "1"
+
+def test_parse_dept_page_scales_linearly(monkeypatch):
+    (small, courses) = count_rule_checks(monkeypatch, lambda: parse_dept_page("CMSC", dept_page(100), track_progress=False))
+    assert [course.course_code for course in courses] == [f"CMSC{i:03d}" for i in range(100)]
+    (large, courses) = count_rule_checks(monkeypatch, lambda: parse_dept_page("CMSC", dept_page(400), track_progress=False))
+    assert len(courses) == 400
+    # 4 times the courses visit about 4 times the tags; matching every tag
+    # against every course id would take about 16 times as many checks
+    assert large < 6 * small